@@ -1,14 +1,37 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import os, sys, argparse
+import os, sys, argparse, shlex, importlib
+import io, re, json, decimal, hashlib, shutil, tempfile, itertools, functools, time
+import cProfile
+import concurrent.futures
+import threading, collections, http.server
+import tracemalloc
+from contextlib import redirect_stdout, contextmanager
 import datetime as dt
-import pandas as pd
-import numpy as np
 import csv # QUOTE_MINIMAL, QUOTE_ALL, QUOTE_NONE, and QUOTE_NONNUMERIC
 
+# pandas and numpy are imported when they are used for the first time, so
+# that --help, argument errors and --accounts do not wait for the import.
+# On the first attribute access the placeholder imports the module and
+# replaces itself in the globals of this script by the module.
 
-programVersion = '1.9.2'
-lastModified = '09-07-2022'
+class LazyModule:
+
+    def __init__(self, name, alias):
+        self.name = name
+        self.alias = alias
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self.name)
+        globals()[self.alias] = module
+        return getattr(module, attribute)
+
+pd = LazyModule('pandas', 'pd')
+np = LazyModule('numpy', 'np')
+
+
+programVersion = '1.33.0'
+lastModified = '17-10-2026'
 
 #
 # PURPOSE: autocomplete GDPdU to allow import in MonkeyOffice
@@ -45,6 +68,16 @@ defDebitAccountNo = '1600'
 sxCollectivePostings = 'Sammelbuchungen'
 sxImportProSaldo = 'Import'
 sxTransactions = 'Transaktionen'
+sxBonReport = 'BonPruefung'
+sxState = 'Verarbeitungsstand'
+sxColumnStore = 'Spaltenspeicher'
+sxRepairLog = 'Reparatur'
+
+# cache for preprocessed dataframes (option --cache)
+
+defCacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'analyzeGDPdU')
+defCacheSizeMB = 1024
+cacheFormatVersion = 3
 
 # Datenformat des GDPdU Exports
 
@@ -76,6 +109,25 @@ dRequiredFields = {
     'Dst/Ware': "string"
 }
 
+# Data types of the numeric columns for the single-read engine (option --engine single)
+
+dNumericFields = {
+    'Bon_Nummer': "int64",
+    'Anzahl': "int64",
+    'Umsatz Br.': "float64",
+    'Einzel VK Br.': "float64",
+    'MwSt': "float64"
+}
+
+# Compact mode (option --compact): text columns with few distinct values
+# are stored as categoricals (integer codes) from read time on.
+# The derived columns are converted after preprocessing.
+
+lCompactColumns = ['Datum', 'Uhrzeit', 'Produkt', 'MwSt-Satz', 'Dst/Ware']
+lCompactDerived = ['Soll/Haben', 'Konto', 'Gegenkonto', 'St-SL', 'ChangeLog']
+
+dCompactFields = dict(dRequiredFields, **{name: "category" for name in lCompactColumns})
+
 # Dictionary MWSt Satz -> Prosaldo Steuerschlüssel
 
 dTaxKey = {
@@ -124,6 +176,18 @@ dCAGoods = {
     'USt19': '4405'     # Umsatzsteuer 19%
 }
 
+# Rules with validity intervals for tax keys and revenue accounts (option --rules)
+# Without a rule file the dictionaries above are used for the whole export.
+# With a rule file each rule maps a tax rate (column 'MwSt-Satz') to the
+# ProSaldo tax key and the revenue accounts for services and goods on the
+# days from 'Gültig ab' to 'Gültig bis' (both included, empty = unlimited),
+# e.g. the reduced rates USt5 and USt16 from 2020-07-01 to 2020-12-31.
+# The rule file is a CSV file (';', UTF-8), lines starting with '#' are
+# comments, the first line is the header lTaxRuleColumns.
+
+lTaxRuleColumns = ['Gültig ab', 'Gültig bis', 'MwSt-Satz', 'St-SL', 'Konto Dienst', 'Konto Ware']
+lTaxRules = []
+
 # Predefined list of prodcuts to calculate sales by product
 # Selection criteria: column 'Konto' must match
 
@@ -131,6 +195,161 @@ topProducts = ['Erwachsene', 'Feierabend/2 Std.', 'Studenten' ]
 
 topCoupons = ['10er Erw.', '20er Erw.',  '10er Spezial', '20er Spezial', '50er Spezial' ]
 
+# Accounting per processing stage (options --profile and --memory).
+# The stages of the pipeline run in "with stage(name):". With accounting
+# enabled (startStages) each stage records its wall time, the number of rows
+# it gets and returns and the peak RSS of the process (ru_maxrss, a
+# high-water mark since program start). With option --memory a stage also
+# records the peak of the memory traced by tracemalloc (python objects and
+# numpy/pandas buffers). Tracing slows down the program, so --profile alone
+# does not trace.
+# Stages can be nested: the peak of an inner stage counts for the outer stage.
+# A stage that runs several times (e.g. per chunk or per period) is reported
+# once with the number of calls, the sum of the times and rows and the maximum
+# of its peaks. With option --profile-json each call is also written as a
+# JSON line.
+# Without accounting a stage does nothing but yield.
+# A stage can also be used as a function decorator: @stage(name). The rows
+# in are those of the first dataframe argument, the rows out those of the
+# (first) dataframe returned. A "with" stage sets them with stageRows.
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+dStages = {}
+lStageStack = []
+stageOptions = {'enabled': False, 'memory': False, 'json': None}
+
+def startStages(memory: bool = True, jsonFile=None):
+
+    dStages.clear()
+    stageOptions['enabled'] = True
+    stageOptions['memory'] = memory
+    if memory:
+        tracemalloc.start()
+    if jsonFile is not None:
+        stageOptions['json'] = open(jsonFile, 'w', encoding='utf-8')
+
+def maxRSS():
+
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024 # bytes on macOS, KB on Linux
+
+def countRows(value):
+
+    if isinstance(value, tuple):
+        value = next((item for item in value if isinstance(item, (pd.DataFrame, pd.Series))), None)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.shape[0]
+    return None
+
+def stageRows(rowsIn=None, rowsOut=None):
+
+    if not stageOptions['enabled'] or not lStageStack:
+        return
+    if rowsIn is not None:
+        lStageStack[-1]['rowsIn'] = rowsIn
+    if rowsOut is not None:
+        lStageStack[-1]['rowsOut'] = rowsOut
+
+class Stage:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if stageOptions['enabled']:
+            enterStage(self.name)
+        return self
+
+    def __exit__(self, *exception):
+        if stageOptions['enabled']:
+            exitStage()
+        return False
+
+    def __call__(self, function):
+
+        @functools.wraps(function)
+        def staged(*args, **kwargs):
+            if not stageOptions['enabled']:
+                return function(*args, **kwargs)
+            with Stage(self.name):
+                stageRows(rowsIn=next((countRows(arg) for arg in args if countRows(arg) is not None), None))
+                result = function(*args, **kwargs)
+                stageRows(rowsOut=countRows(result))
+            return result
+
+        return staged
+
+def stage(name):
+
+    return Stage(name)
+
+def enterStage(name):
+
+    record = {'name': name, 'depth': len(lStageStack), 'time': time.perf_counter(),
+        'rowsIn': None, 'rowsOut': None, 'start': 0, 'peak': 0}
+    if stageOptions['memory']:
+        if lStageStack:
+            lStageStack[-1]['peak'] = max(lStageStack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        record['start'] = tracemalloc.get_traced_memory()[0]
+    lStageStack.append(record)
+
+def exitStage():
+
+    record = lStageStack.pop()
+    seconds = time.perf_counter() - record['time']
+    if stageOptions['memory']:
+        record['peak'] = max(record['peak'], tracemalloc.get_traced_memory()[1])
+        if lStageStack:
+            lStageStack[-1]['peak'] = max(lStageStack[-1]['peak'], record['peak'])
+    rss = maxRSS()
+
+    summary = dStages.setdefault(record['name'], {'depth': record['depth'], 'calls': 0, 'seconds': 0.0,
+        'rowsIn': None, 'rowsOut': None, 'start': record['start'], 'peak': 0, 'rss': 0})
+    summary['calls'] += 1
+    summary['seconds'] += seconds
+    for rows in ['rowsIn', 'rowsOut']:
+        if record[rows] is not None:
+            summary[rows] = (summary[rows] or 0) + record[rows]
+    summary['peak'] = max(summary['peak'], record['peak'])
+    summary['rss'] = rss
+
+    if stageOptions['json'] is not None:
+        line = {'stage': record['name'], 'depth': record['depth'], 'seconds': round(seconds, 6),
+            'rowsIn': record['rowsIn'], 'rowsOut': record['rowsOut'], 'rssMB': round(rss / 1024**2, 1)}
+        if stageOptions['memory']:
+            line['peakMB'] = round(record['peak'] / 1024**2, 1)
+        stageOptions['json'].write(json.dumps(line, ensure_ascii=False) + '\n')
+
+def printStages():
+
+    if not stageOptions['enabled']:
+        return
+    if stageOptions['json'] is not None:
+        stageOptions['json'].close()
+        stageOptions['json'] = None
+
+    memory = stageOptions['memory']
+    formatRows = lambda rows: '' if rows is None else str(rows)
+    formatMB = lambda value: '{:.1f}'.format(value / 1024**2) if memory else '-'
+
+    print("\n###### Laufzeit und Speicherbedarf je Verarbeitungsschritt (Sekunden, Zeilen, MB)\n")
+    print("{:<48} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format('Schritt', 'Anzahl', 'Zeit',
+        'Zeilen ein', 'Zeilen aus', 'Beginn', 'Spitze', 'RSS max'))
+    for name, summary in dStages.items():
+        print("{:<48} {:>7d} {:>10.3f} {:>10} {:>10} {:>10} {:>10} {:>10.1f}".format('  ' * summary['depth'] + name, summary['calls'],
+            summary['seconds'], formatRows(summary['rowsIn']), formatRows(summary['rowsOut']),
+            formatMB(summary['start']), formatMB(summary['peak']), summary['rss'] / 1024**2))
+    peak = max((summary['peak'] for summary in dStages.values()), default=0)
+    print("\n{:<48} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10.1f}".format('Gesamt', '', '', '', '', '',
+        formatMB(peak), maxRSS() / 1024**2))
+
 # read csv file containing all GDPdU output
 # we read required columns only
 # we read all values as string and do the datatype conversion later
@@ -142,7 +361,8 @@ topCoupons = ['10er Erw.', '20er Erw.',  '10er Spezial', '20er Spezial', '50er S
 # The workaround is to read the header and find out at wich position (column)
 # we find the required data.
 
-def readCSV(infile):
+@stage('CSV Header lesen')
+def readCSVHeader(infile):
 
 # Load only the column names from csv file
 # Note: This will result in an empty dataframe!
@@ -153,7 +373,12 @@ def readCSV(infile):
         print("Fehler beim Lesen des CSV Headers vom enforePOS GDPdU output {}: {}".format(infile, sys.exc_info()[0]))
         exit(1)
 
-    availableColumns = da.columns.tolist()
+    return resolveColumns(da.columns.tolist(), infile)
+
+# Find the positions of the required columns in the list of available columns.
+
+def resolveColumns(availableColumns, infile):
+
     fieldNames = list(dRequiredFields.keys())
     fieldPositions = []
     print ("\nPrüfe CSV Datei auf erforderliche Daten {}\n".format(str(fieldNames)))
@@ -172,8 +397,155 @@ def readCSV(infile):
     else:
         print("Die Spalten {} der CSV Datei {} werden eingelesen".format(str(fieldPositions), infile))
 
+    return fieldNames, fieldPositions
+
+# Repair of lines with separators in the column 'Produkt'.
+# KI-Kasse does not quote text fields, a ';' typed into a product name gives
+# a line with more fields than the header. RepairingReader is a binary
+# file-like object in front of pandas: it reads the export in blocks of
+# repairBlockBytes bytes, counts the separators of all lines of a block at once
+# with numpy and passes a block without surplus separators on as it is.
+# In a line with too many fields, the fields before 'Produkt' are taken from
+# the start of the line and the fields after 'Produkt' from its end, the
+# fields in between are joined into 'Produkt' again, quoted for pandas.
+# A line is only repaired if the anchored field 'Dst/Ware' is then 'Dienst'
+# or 'Ware'. At the end of the file the repaired and the not repairable lines
+# are written to the file <FILE>_Reparatur (Zeile counts from the header line
+# of the data read, in incremental mode the new rows only).
+
+repairBlockBytes = 1 << 20
+lDstWare = [b'Dienst', b'Ware']
+
+class RepairingReader(io.RawIOBase):
+
+    def __init__(self, handle, infile):
+        self.handle = handle
+        self.infile = infile
+        header = handle.readline()
+        names = [name.strip() for name in header.decode('latin-1').rstrip('\r\n').split(';')]
+        self.nSeparators = len(names) - 1
+        self.positions = {name: names.index(name) for name in ['Bon_Nummer', 'Produkt', 'Dst/Ware'] if name in names}
+        self.block, self.position, self.rest = header, 0, b''
+        self.lineNo = 1
+        self.eof = False
+        self.repairs = []
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.position == len(self.block) and not self.eof:
+            self.block, self.position = self.nextBlock(), 0
+        n = min(len(buffer), len(self.block) - self.position)
+        buffer[:n] = self.block[self.position:self.position + n]
+        self.position += n
+        return n
+
+    def close(self):
+        self.handle.close()
+        super().close()
+
+# next block of complete lines, the rest of the last line is kept for the next block
+
+    def nextBlock(self):
+
+        data = self.handle.read(repairBlockBytes)
+        if not data:
+            self.eof = True
+            block, self.rest = self.rest, b''
+            block = self.repairBlock(block)
+            reportRepairs(self.infile, self.repairs)
+            return block
+        data = self.rest + data
+        end = data.rfind(b'\n') + 1
+        block, self.rest = data[:end], data[end:]
+        return self.repairBlock(block)
+
+    def repairBlock(self, block):
+
+        if not block or 'Produkt' not in self.positions:
+            return block
+        buf = np.frombuffer(block, dtype=np.uint8)
+        ends = np.flatnonzero(buf == ord('\n'))
+        if not block.endswith(b'\n'):
+            ends = np.append(ends, len(block))
+        separators = np.searchsorted(np.flatnonzero(buf == ord(';')), ends)
+        lines = np.flatnonzero(np.diff(separators, prepend=0) > self.nSeparators)
+        firstLine = self.lineNo + 1
+        self.lineNo += len(ends)
+        if not lines.size:
+            return block
+
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        pieces = []
+        position = 0
+        for n in lines:
+            pieces.append(block[position:starts[n]])
+            pieces.append(self.repairLine(block[starts[n]:ends[n]], firstLine + int(n)))
+            position = ends[n]
+        pieces.append(block[position:])
+        return b''.join(pieces)
+
+    def repairLine(self, line, lineNo):
+
+        fields = line.split(b';')
+        product = self.positions['Produkt']
+        last = product + len(fields) - self.nSeparators
+        fields[product:last] = [b';'.join(fields[product:last])]
+        kind = self.positions.get('Dst/Ware')
+        repaired = kind is None or fields[kind].strip() in lDstWare
+        bon = fields[self.positions['Bon_Nummer']].strip() if 'Bon_Nummer' in self.positions else b''
+        self.repairs.append((lineNo, bon.decode('latin-1'), fields[product].strip().decode('latin-1'),
+            'repariert' if repaired else 'nicht repariert', line.rstrip(b'\r').decode('latin-1')))
+        if not repaired:
+            return line
+        fields[product] = b'"' + fields[product].replace(b'"', b'""') + b'"'
+        return b';'.join(fields)
+
+def openExport(infile, handle=None):
+
+    return io.BufferedReader(RepairingReader(open(infile, 'rb') if handle is None else handle, infile))
+
+def reportRepairs(infile, repairs):
+
+    if not repairs:
+        return
+    nRepaired = sum(1 for repair in repairs if repair[3] == 'repariert')
+    outfile = outputFileName(infile, '_' + sxRepairLog)
+    print("\nWARNUNG: {} Zeilen mit Trennzeichen in der Spalte Produkt, davon {} repariert.".format(len(repairs), nRepaired))
     try:
-        da = pd.read_csv(infile, sep=';', skiprows=[0], encoding='latin-1', decimal=",", usecols=fieldPositions,  names=fieldNames, dtype=dRequiredFields)
+        with open(outfile, 'w', encoding='latin-1', newline='') as f:
+            writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_NONNUMERIC)
+            writer.writerow(['Zeile', 'Bon_Nummer', 'Produkt', 'Status', 'Original'])
+            writer.writerows(repairs)
+    except OSError:
+        print("\tWARNUNG: Die Datei {} konnte nicht geschrieben werden: {}".format(outfile, sys.exc_info()[1]))
+        return
+    print("Die Zeilen sind in der Datei {} aufgeführt.".format(outfile))
+
+def checkDstWare(da):
+
+    df=da[~da['Dst/Ware'].isin(["Dienst", "Ware"])]
+    if not df.empty:
+        print("WARNUNG: Der GDPdU Export enhält unbekannte Dienst / Ware Kennzeichen.")
+        print(da['Dst/Ware'].unique().to_numpy())
+        print("Mögliche Ursache ist die Verwendung von Trennzeichen im der Spalte Produkt")
+        print(df.head(10))
+
+@stage('CSV Daten lesen')
+def readCSV(infile, compact: bool = False, engine: str = 'classic'):
+
+    if engine == 'single':
+        da = readCSVSingle(infile, compact)
+        checkDstWare(da)
+        return(da)
+
+    fieldNames, fieldPositions = readCSVHeader(infile)
+    dtype = dCompactFields if compact else dRequiredFields
+
+    try:
+        with openExport(infile) as handle:
+            da = pd.read_csv(handle, sep=';', skiprows=[0], encoding='latin-1', decimal=",", usecols=fieldPositions,  names=fieldNames, dtype=dtype)
     except:
         print("Fehler beim Einlesen der Daten von der CSV Datei {}: {}".format(infile, sys.exc_info()[0]))
         exit(1)
@@ -183,15 +555,87 @@ def readCSV(infile):
 
 #    print(da.head(10))
 
-    df=da[~da['Dst/Ware'].isin(["Dienst", "Ware"])]
-    if not df.empty:
-        print("WARNUNG: Der GDPdU Export enhält unbekannte Dienst / Ware Kennzeichen.")
-        print(da['Dst/Ware'].unique().to_numpy())
-        print("Mögliche Ursache ist die Verwendung von Trennzeichen im der Spalte Produkt")
-        print(df.head(10))
+    checkDstWare(da)
 
     return(da)
 
+# read the csv file in chunks of chunksize rows (streaming mode)
+# returns an iterator over dataframes with the same columns as readCSV
+
+def readCSVChunks(infile, chunksize, compact: bool = False, engine: str = 'classic'):
+
+    if engine == 'single':
+        return readCSVSingle(infile, compact, chunksize)
+
+    fieldNames, fieldPositions = readCSVHeader(infile)
+    dtype = dCompactFields if compact else dRequiredFields
+
+    try:
+        handle = openExport(infile)
+        reader = pd.read_csv(handle, sep=';', skiprows=[0], encoding='latin-1', decimal=",", usecols=fieldPositions,  names=fieldNames, dtype=dtype, chunksize=chunksize)
+    except:
+        print("Fehler beim Einlesen der Daten von der CSV Datei {}: {}".format(infile, sys.exc_info()[0]))
+        exit(1)
+
+    return closingReader(handle, reader)
+
+# Single-read ingestion (option --engine single).
+# The header line is read from the open file and the required columns are
+# resolved by name, the rest of the file is parsed in the same pass.
+# Numeric columns are parsed straight into their final types (German number
+# format with thousands separator . and decimal ,). Text columns are read as
+# categoricals and only the categories are stripped. Without compact mode
+# they are converted back to strings, so that the dataframe matches readCSV.
+# The dataframe is marked as stripped (attrs), preprocessDataframe skips the
+# strip pass then.
+
+def readCSVSingle(infile, compact: bool = False, chunksize=None, handle=None):
+
+    try:
+        if handle is None:
+            handle = io.TextIOWrapper(openExport(infile), encoding='latin-1', newline='')
+        header = next(csv.reader([handle.readline()], delimiter=';'))
+    except:
+        print("Fehler beim Lesen des CSV Headers vom enforePOS GDPdU output {}: {}".format(infile, sys.exc_info()[0]))
+        exit(1)
+
+    fieldNames, fieldPositions = resolveColumns(header, infile)
+    columns = dict(zip(fieldPositions, fieldNames))
+    dtype = {position: dNumericFields.get(name, "category") for position, name in columns.items()}
+
+    try:
+        reader = pd.read_csv(handle, sep=';', header=None, decimal=",", thousands='.', float_precision='round_trip',
+            usecols=fieldPositions, dtype=dtype, chunksize=chunksize)
+        if chunksize is None:
+            with handle:
+                return cleanSingleRead(reader, columns, compact)
+    except:
+        handle.close()
+        print("Fehler beim Einlesen der Daten von der CSV Datei {}: {}".format(infile, sys.exc_info()[0]))
+        exit(1)
+
+    return (cleanSingleRead(chunk, columns, compact) for chunk in closingReader(handle, reader))
+
+def closingReader(handle, reader):
+
+    with handle:
+        yield from reader
+
+def cleanSingleRead(da, columns, compact: bool = False):
+
+    data = {}
+    for position, name in columns.items():
+        values = da[position].rename(name)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = compactColumn(values)
+            if not compact:
+                values = values.astype("string")
+        data[name] = values
+    da = pd.DataFrame(data)
+    da.attrs['stripped'] = True
+
+    return da
+
 # read the dataframe from csv file containing all GDPdU output
 # tested with GDPdU output from enforePOS
 # we specifiy a format for each column (mostly string)
@@ -208,16 +652,138 @@ def readCSV_All(infile):
 # write dataframe to csv file without index.
 # Note: we apply rounding when we write the csv float_format='%.2f'
 
-def writeCSV(infile, qualifier, df, quot):
-    outfile = os.path.splitext(infile)[0] + qualifier + os.path.splitext(infile)[1]
+def outputFileName(infile, qualifier):
+    return os.path.splitext(infile)[0] + qualifier + os.path.splitext(infile)[1]
+
+# Fast CSV writer, the files are the same bytes as written by DataFrame.to_csv
+# (MonkeyOffice/ProSaldo imports them). The rows are written in chunks of
+# csvChunkRows rows. In each chunk every column is factorized and only its
+# distinct values are formatted, by to_csv itself, so quoting and the number
+# and date formats are those of to_csv. The memory needed depends on the chunk
+# size, not on the number of rows. A chunk with columns that can not be
+# factorized or with multi-line texts is written by to_csv, dataframes with a
+# single column are written by to_csv as a whole.
+# Amounts in cents are written in euros (see centsToEuro).
+
+csvChunkRows = 10000
+dCSVFormat = {'sep': ';', 'decimal': ',', 'float_format': '%.2f', 'index': False}
+
+def formatColumnValues(values, quot):
+
+    if values.dtype.kind == 'f':
+        # factorize the bit patterns, 0.0 and -0.0 are formatted differently
+        data = values.to_numpy()
+        codes, uniques = pd.factorize(data.view(data.dtype.str.replace('f', 'i')))
+        uniques = uniques.view(data.dtype)
+    else:
+        codes, uniques = pd.factorize(values.array, use_na_sentinel=False)
+    # the second column avoids rows with a single empty field, to_csv quotes them
+    text = pd.DataFrame({'v': uniques, 'k': 0}).to_csv(header=False, quoting=quot, lineterminator='\n', **dCSVFormat)
+    cells = [line[:-2] for line in text.split('\n')[:-1]]
+    if len(cells) != len(uniques):
+        return None
+    return codes, np.array(cells, dtype=object)
+
+def formatChunk(df, quot):
+
     try:
-        df.to_csv(path_or_buf=outfile, sep=';', encoding='latin-1', decimal=",", float_format='%.2f', index=False, quoting=quot)
-    except:
+        columns = [formatColumnValues(df.iloc[:, n], quot) for n in range(df.shape[1])]
+    except TypeError: # unhashable objects
+        columns = [None]
+    if any(column is None for column in columns):
+        return df.to_csv(header=False, quoting=quot, **dCSVFormat)
+    rows = zip(*[cells.take(codes).tolist() for codes, cells in columns])
+    return os.linesep.join(map(';'.join, rows)) + os.linesep
+
+def csvChunks(df, quot, header=True):
+
+    # to_csv quotes a row with a single empty field
+    if isinstance(df.columns, pd.MultiIndex) or df.shape[1] < 2:
+        return None
+
+    def chunks():
+        if header:
+            yield df.iloc[:0].to_csv(quoting=quot, **dCSVFormat)
+        for start in range(0, df.shape[0], csvChunkRows):
+            yield formatChunk(df.iloc[start:start + csvChunkRows], quot)
+
+    return chunks()
+
+def writeFrame(outfile, df, quot):
+
+    df = centsToEuro(df)
+    chunks = csvChunks(df, quot)
+    if chunks is None:
+        df.to_csv(path_or_buf=outfile, encoding='latin-1', quoting=quot, **dCSVFormat)
+        return
+    with open(outfile, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk.encode('latin-1'))
+
+# Within concurrentCSV() the output files are written by a pool of
+# csvWriterThreads threads while the analysis goes on. The messages are
+# printed in the order of the files when the block ends. The dataframes
+# must not be changed after writeCSV. At most csvWriterThreads files are
+# being written or waiting, writeCSV waits for a free thread otherwise, so
+# the writers keep no more than csvWriterThreads dataframes alive while the
+# analysis goes on. With stage accounting (options
+# --profile and --memory) the files are written one after another, so that
+# each write is a stage of its own.
+
+csvWriterThreads = 2
+dCSVJobs = {'executor': None, 'jobs': []}
+
+@contextmanager
+def concurrentCSV():
+
+    if dCSVJobs['executor'] is not None or stageOptions['enabled']: # nested or accounting
+        yield
+        return
+    dCSVJobs['executor'] = concurrent.futures.ThreadPoolExecutor(max_workers=csvWriterThreads)
+    try:
+        yield
+    finally:
+        executor, jobs = dCSVJobs['executor'], dCSVJobs['jobs']
+        dCSVJobs['executor'], dCSVJobs['jobs'] = None, []
+        with stage('CSV schreiben'):
+            executor.shutdown(wait=True)
+        for outfile, job in jobs:
+            reportCSV(outfile, job.exception())
+
+def reportCSV(outfile, error):
+
+    if error is not None:
         print("Dataframe konnte nicht gespeichert werden {}\n".format(outfile))
-        pass
-
     print("\nDataframe als CSV Datei gespeichert: {}".format(outfile))
 
+def writeCSV(infile, qualifier, df, quot):
+    outfile = outputFileName(infile, qualifier)
+    if dCSVJobs['executor'] is not None:
+        pending = [job for name, job in dCSVJobs['jobs'] if not job.done()]
+        if len(pending) >= csvWriterThreads:
+            concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        dCSVJobs['jobs'].append((outfile, dCSVJobs['executor'].submit(writeFrame, outfile, df, quot)))
+        return
+    error = None
+    try:
+        with stage('CSV schreiben ' + qualifier.split('_')[1]):
+            stageRows(rowsIn=df.shape[0])
+            writeFrame(outfile, df, quot)
+    except Exception as e:
+        error = e
+    reportCSV(outfile, error)
+
+# append dataframe to an open csv file (streaming mode), same format as writeCSV
+
+def appendCSV(handle, df, quot, header):
+    df = centsToEuro(df)
+    chunks = csvChunks(df, quot, header)
+    if chunks is None:
+        df.to_csv(path_or_buf=handle, quoting=quot, header=header, **dCSVFormat)
+        return
+    for chunk in chunks:
+        handle.write(chunk)
+
 # Convenience Function;
 
 def printUniqueKonto(df, nameKonto):
@@ -234,15 +800,158 @@ def printUniqueKonto(df, nameKonto):
 def convertColumnToFloat (df, cName):
 
     print("\tNeuer Datentyp für Spalte {} ist float".format(cName))
+    if pd.api.types.is_float_dtype(df[cName]):
+        return
 #    df[cName] = df[cName].str.replace('.','').str.replace(',','.').astype(float)
     df[cName] = df[cName].str.replace('.','', regex=False).str.replace(',','.', regex=False).astype(float)
 
+# Money in integer cents (option --money cents or verify).
+# The amounts are parsed into int64 cents, Umsatz and all sums are computed
+# with integers and divided by 100 only when they are written or printed.
+# The division gives the float closest to the exact amount, so '%.2f' writes
+# the exact amount. The columns in lMoneyColumns with an integer dtype hold
+# cents, with dtype float they hold euros (option --money float, default).
+
+lMoneyColumns = ['Umsatz Br.', 'Einzel VK Br.', 'MwSt', 'Umsatz', 'Betrag', 'Summe Positionen', 'Umsatz Dienst', 'Umsatz Ware']
+lMoneyModes = ['float', 'cents', 'verify']
+
+def isCentColumn(values):
+
+    isMoney = values.name in lMoneyColumns or str(values.name).startswith('MwSt ') # tax per key (receiptTable)
+    return isMoney and pd.api.types.is_integer_dtype(values.dtype)
+
+def centsToEuro(df):
+
+    columns = [name for name in df.columns if isCentColumn(df[name])]
+    if not columns:
+        return df
+    df = df.copy(deep=False)
+    for name in columns:
+        df[name] = df[name].to_numpy() / 100
+    return df
+
+# Parse amounts in the German number format (e.g. -1.234,5) into cents.
+# values is an array of distinct strings. The strings are parsed all at once
+# as a matrix of bytes (one row per string): the dots are skipped, each digit
+# gets the power of ten of its position relative to the decimal comma.
+# Returns the cents, a mask of the valid values and a mask of the values
+# rounded to cents. Valid are digits, at most one comma, a leading minus, at
+# most 16 digits before the comma and dots as thousands separators only: after
+# a digit, before the comma and followed by groups of three digits.
+# A value with a non-zero digit after the second decimal place is rounded
+# half away from zero (roundCents), as with --engine single.
+
+pow10 = [10**n for n in range(19)]
+
+# Round decimal strings (e.g. '-12.345') to cents, half away from zero.
+# Only used for the few amounts with more than two decimals, so both engines
+# round the written amount the same way, not its float.
+
+def roundCents(texts):
+
+    return np.array([int(decimal.Decimal(text).scaleb(2).quantize(1, rounding=decimal.ROUND_HALF_UP)) for text in texts], dtype=np.int64)
+
+def parseCents(values):
+
+    try:
+        text = np.array(values, dtype='S')
+    except UnicodeEncodeError: # not ASCII, not a number
+        text = np.array([value if value.isascii() else '?' for value in values], dtype='S')
+    if text.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    b = text.view(np.uint8).reshape(text.size, -1)
+    column = np.arange(b.shape[1])
+
+    isDigit = (b >= ord('0')) & (b <= ord('9'))
+    isComma = b == ord(',')
+    isDot = b == ord('.')
+    isMinus = b == ord('-')
+    length = (b != 0).sum(axis=1)
+
+    comma = np.where(isComma.any(axis=1), isComma.argmax(axis=1), length)[:, None]
+    integer = isDigit & (column < comma)
+    fraction = isDigit & (column > comma)
+    decimals = np.cumsum(fraction, axis=1)
+    digitsAfter = np.cumsum(integer[:, ::-1], axis=1)[:, ::-1] - integer
+    dotsFrom = np.cumsum(isDot[:, ::-1], axis=1)[:, ::-1]
+    afterDigit = np.zeros_like(isDigit)
+    afterDigit[:, 1:] = isDigit[:, :-1]
+
+    valid = ((isDigit | isComma | isDot | isMinus | (b == 0)).all(axis=1)
+        & (isComma.sum(axis=1) <= 1)
+        & (isMinus.sum(axis=1) == isMinus[:, 0])
+        & ~(isDot & ((column > comma) | ~afterDigit | (digitsAfter != 3 * dotsFrom))).any(axis=1)
+        & isDigit.any(axis=1)
+        & (integer.sum(axis=1) <= 16))
+    rounded = valid & (fraction & (decimals > 2) & (b != ord('0'))).any(axis=1)
+
+    exponent = np.where(integer, digitsAfter + 2, 2 - decimals)
+    weights = np.array(pow10, dtype=np.int64)[np.clip(exponent, 0, 18)]
+    weights[~(integer | (fraction & (decimals <= 2)))] = 0
+    cents = ((b.astype(np.int64) - ord('0')) * weights).sum(axis=1)
+    cents[isMinus[:, 0]] *= -1
+    cents[~valid] = 0
+    if rounded.any():
+        texts = [value.replace('.', '').replace(',', '.') for value in np.asarray(values, dtype=object)[rounded]]
+        cents[rounded] = roundCents(texts)
+
+    return cents, valid, rounded
+
+# Convert a money column to int64 cents. Text columns are factorized and only
+# the distinct values are parsed, float columns (option --engine single) are
+# read with round_trip precision, so the shortest repr of a float is the
+# amount in the export. Amounts with more than two decimals are rounded half
+# away from zero with a warning by both engines. With verify the distinct
+# values are also converted by the float path (convertColumnToFloat) and any
+# difference is reported. Missing amounts count as 0 cents.
+
+def convertColumnToCents(df, cName, verify: bool = False):
+
+    print("\tNeuer Datentyp für Spalte {} ist int64 (Cent)".format(cName))
+    values = df[cName]
+    if pd.api.types.is_integer_dtype(values.dtype):
+        return
+
+    if pd.api.types.is_float_dtype(values.dtype):
+        euros = values.to_numpy()
+        missing = np.isnan(euros)
+        cents = np.rint(np.where(missing, 0, euros) * 100).astype(np.int64)
+        inexact = np.abs(np.where(missing, 0, euros) * 100 - cents) > 1e-3
+        if inexact.any():
+            cents[inexact] = roundCents([repr(euro) for euro in euros[inexact]])
+            print("\tWARNUNG: Beträge mit mehr als zwei Nachkommastellen in Spalte {} werden auf Cent gerundet: {}".format(cName, list(np.unique(euros[inexact])[:10])))
+        codes = np.where(missing, -1, 0)
+        df[cName] = cents
+    else:
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, uniques = pd.factorize(values)
+        uniques = np.asarray(uniques, dtype=object)
+        cents, valid, rounded = parseCents(uniques)
+        if not valid.all():
+            print("\tFehler: Die folgenden Beträge in Spalte {} sind keine Zahlen im Format -1.234,56: {}".format(cName, list(uniques[~valid][:10])))
+            exit(1)
+        if rounded.any():
+            print("\tWARNUNG: Beträge mit mehr als zwei Nachkommastellen in Spalte {} werden auf Cent gerundet: {}".format(cName, list(uniques[rounded][:10])))
+        if verify:
+            floats = pd.Series(uniques, dtype=object).str.replace('.','', regex=False).str.replace(',','.', regex=False).astype(float)
+            differs = np.rint(floats.to_numpy() * 100) != cents
+            if differs.any():
+                print("\tWARNUNG: Abweichung zum Einlesen als float in Spalte {}: {}".format(cName, list(uniques[differs][:10])))
+        df[cName] = np.append(cents, 0)[codes]
+
+    if (codes < 0).any():
+        print("\tWARNUNG: {} fehlende Beträge in Spalte {} werden als 0 gezählt".format(int((codes < 0).sum()), cName))
+
 
 # converting string to integer
 
 def convertColumnToInteger (df, cName):
 
     print("\tNeuer Datentyp für Spalte {} ist integer".format(cName))
+    if pd.api.types.is_integer_dtype(df[cName]):
+        return
     df[cName] = df[cName].astype(int)
 
 #
@@ -288,6 +997,19 @@ def getCreditAccountGoods (taxKey):
 
     return pCreditAccount
 
+#
+# Compile a lookup function into a lookup table for the distinct values
+# of a column. The function is called once per distinct value, so that
+# its warnings are printed only once. If missing is True, the entry for
+# missing values (code -1) is appended at the end.
+
+def lookupTable(uniques, lookup, missing: bool = False):
+
+    table = [lookup(value) for value in uniques]
+    if missing:
+        table.append(lookup(np.NaN))
+    return np.array(table, dtype=object)
+
 #
 # print dictionaries for goods and services
 #
@@ -297,6 +1019,191 @@ def printAccountDict(a_dict, prefix):
         accNo = v
         print ("{:<8} {:<20}".format(accNo, prefix + ' ' + k))
 
+# Print the accounts for the collective postings (also option --accounts)
+
+def printAccountPlan():
+
+    if lTaxRules:
+        printTaxRules()
+        return
+    print("\n###### Kontenrahmen für Sammelbuchungen Dienstleistungen\n")
+    printAccountDict(dCAService, "Erlöse Dienstleistungen")
+    print("\n###### Kontenrahmen für Sammelbuchungen Waren\n")
+    printAccountDict(dCAGoods, "Erlöse Waren")
+
+def printTaxRules():
+
+    print("\n###### Regeln für Steuerschlüssel und Erlöskonten\n")
+    print("{:<12} {:<12} {:>9}  {:<8} {:<12} {:<12}".format(*lTaxRuleColumns))
+    for rule in lTaxRules:
+        print("{:<12} {:<12} {:>9}  {:<8} {:<12} {:<12}".format(rule['von'], rule['bis'], formatTaxRate(rule['rate']),
+            rule['St-SL'], rule['Dienst'], rule['Ware']))
+
+# Tax rates are compared as numbers in hundredths of a percent,
+# so that '19', '19,00' and '19.0' are the same rate. None if not a number.
+
+def parseTaxRate(text):
+
+    try:
+        rate = float(str(text).strip().replace(',', '.'))
+    except ValueError:
+        return None
+    return int(round(rate * 100)) if np.isfinite(rate) else None
+
+def formatTaxRate(rate):
+
+    return ('%g' % (rate / 100)).replace('.', ',')
+
+# Read the rule file (option --rules), see lTaxRuleColumns.
+# The rules of a tax rate must not overlap. Errors stop the program.
+
+def loadTaxRules(rulesFile):
+
+    def ruleError(n, message):
+        print("Fehler in der Regeldatei {}, Regel {}: {}".format(rulesFile, n, message))
+        exit(1)
+
+    try:
+        with open(rulesFile, encoding='utf-8', newline='') as f:
+            lines = [line for line in f if line.strip() and not line.lstrip().startswith('#')]
+    except OSError:
+        print("Fehler: Die Regeldatei {} konnte nicht gelesen werden: {}".format(rulesFile, sys.exc_info()[1]))
+        exit(1)
+
+    reader = csv.reader(lines, delimiter=';')
+    header = [name.strip() for name in next(reader, [])]
+    if header[:len(lTaxRuleColumns)] != lTaxRuleColumns:
+        print("Fehler: Die Regeldatei {} braucht die Kopfzeile {}".format(rulesFile, ';'.join(lTaxRuleColumns)))
+        exit(1)
+
+    rules = []
+    for n, row in enumerate(reader, 1):
+        row = [value.strip() for value in row] + [''] * len(lTaxRuleColumns)
+        von, bis, rate, taxKey, service, goods = row[:len(lTaxRuleColumns)]
+        for date in (von, bis):
+            if date:
+                try:
+                    dt.datetime.strptime(date, "%Y-%m-%d")
+                except ValueError:
+                    ruleError(n, "Datum {} hat nicht das Format YYYY-MM-DD".format(date))
+        if von and bis and von > bis:
+            ruleError(n, "Gültig ab {} liegt nach Gültig bis {}".format(von, bis))
+        if parseTaxRate(rate) is None:
+            ruleError(n, "MwSt-Satz {} ist keine Zahl".format(rate))
+        if not (taxKey and service and goods):
+            ruleError(n, "St-SL, Konto Dienst und Konto Ware sind erforderlich")
+        rules.append({'von': von, 'bis': bis, 'rate': parseTaxRate(rate), 'St-SL': taxKey, 'Dienst': service, 'Ware': goods})
+
+    rules.sort(key=lambda rule: (rule['rate'], rule['von']))
+    for previous, rule in zip(rules, rules[1:]):
+        if rule['rate'] == previous['rate'] and (not previous['bis'] or previous['bis'] >= rule['von']):
+            print("Fehler in der Regeldatei {}: die Regeln für MwSt-Satz {} überschneiden sich ({} bis {} und {} bis {})".format(
+                rulesFile, formatTaxRate(rule['rate']), previous['von'] or '...', previous['bis'] or '...', rule['von'] or '...', rule['bis'] or '...'))
+            exit(1)
+    return rules
+
+def selectTaxRules(rulesFile):
+
+    lTaxRules[:] = loadTaxRules(rulesFile) if rulesFile is not None else []
+
+# Tax keys and credit accounts from the dictionaries dTaxKey, dCAService and
+# dCAGoods (no option --rules). The lookup tables are indexed by the codes of
+# the distinct tax rates and tax keys.
+# Returns the tax keys, the credit accounts and the ChangeLog entries.
+
+def applyTaxDictionaries(taxRates, isService):
+
+    rateCodes, uniqueTaxRate = pd.factorize(taxRates)
+    print("\tDie folgenden MwSt. Sätze sind im Dataframe vorhanden: {}\n".format(np.asarray(uniqueTaxRate)))
+
+    taxKeys = lookupTable(uniqueTaxRate, getProSaldoTaxKey, (rateCodes < 0).any())
+    stsl = taxKeys[rateCodes]
+
+#  create an entry in ChangeLog that we have used a fall-back tax key.
+
+    changeLog = np.full(len(taxKeys), np.NaN, dtype=object)
+    changeLog[taxKeys == noTaxKey] = 'no tax key in input file'
+
+    print ("\n### {}\n".format("Generiere ProSaldo Gegenkonten"))
+
+    keyCodes, uniqueTaxKey = pd.factorize(stsl)
+    print("Die folgenden Steuerschlüssel sind im Dataframe vorhanden: {}".format(uniqueTaxKey))
+
+    accountsServices = lookupTable(uniqueTaxKey, getCreditAccountServices, (keyCodes < 0).any())
+    accountsGoods = lookupTable(uniqueTaxKey, getCreditAccountGoods, (keyCodes < 0).any())
+    creditAccount = np.where(isService, accountsServices[keyCodes], accountsGoods[keyCodes])
+    return stsl, creditAccount, changeLog[rateCodes]
+
+# Apply the rules to all transactions at once. The rules are sorted by tax
+# rate and start, and searched with one binary search for the key
+# (rate, second of DateTime) of every transaction, i.e. the rule of the rate
+# with the last start before the transaction. If the transaction is outside
+# the interval of that rule (in a gap or after the last rule) this rule is
+# still used, before the first rule of its rate the first rule is used, and
+# the transaction is flagged in 'ChangeLog'. A rate keeps a tax key of its
+# own rate, so e.g. 19 % in the COVID-19 period of GDPdU_Regeln.csv is
+# booked as USt19, the tax on the receipt, not as USt16.
+# Transactions without date are not flagged.
+# Rates without rules get the fall-back tax key noTaxKey as before.
+# Returns the tax keys, the credit accounts and the ChangeLog entries.
+
+ruleSecondBits = 34     # seconds since 1970 up to the year 2514
+
+def applyTaxRules(taxRates, dateTimes, isService):
+
+    rates = np.array([rule['rate'] for rule in lTaxRules], dtype=np.int64)
+    distinctRates, ruleRates = np.unique(rates, return_inverse=True)
+    firstRule = np.searchsorted(ruleRates, np.arange(len(distinctRates)))
+    ruleKeys = np.array([pd.Timestamp(rule['von'] or '1970-01-01').value // 10**9 for rule in lTaxRules], dtype=np.int64)
+    ruleKeys += ruleRates.astype(np.int64) << ruleSecondBits
+    ruleEnds = np.array([(pd.Timestamp(rule['bis']) + pd.Timedelta(days=1)).value // 10**9 if rule['bis'] else 1 << ruleSecondBits
+        for rule in lTaxRules], dtype=np.int64)
+
+# rate of each transaction: index into distinctRates, -1 if there is no rule for the rate
+
+    rateCodes, uniqueTaxRate = pd.factorize(taxRates)
+    print("\tDie folgenden MwSt. Sätze sind im Dataframe vorhanden: {}\n".format(np.asarray(uniqueTaxRate)))
+    uniqueRates = [parseTaxRate(rate) for rate in uniqueTaxRate]
+    rateIndex = np.full(len(uniqueRates) + 1, -1, dtype=np.int64)
+    for n, (text, rate) in enumerate(zip(uniqueTaxRate, uniqueRates)):
+        position = np.searchsorted(distinctRates, rate) if rate is not None else len(distinctRates)
+        if position < len(distinctRates) and distinctRates[position] == rate:
+            rateIndex[n] = position
+        else:
+            getProSaldoTaxKey(text)
+    if (rateCodes < 0).any():
+        getProSaldoTaxKey(np.NaN)
+    rowRates = rateIndex[rateCodes]
+    known = rowRates >= 0
+
+    hasDate = ~dateTimes.isna().to_numpy()
+    seconds = np.clip(dateTimes.to_numpy().view(np.int64) // 10**9, 0, (1 << ruleSecondBits) - 1)
+    rowKeys = (np.maximum(rowRates, 0) << ruleSecondBits) + seconds
+    ruleNo = np.searchsorted(ruleKeys, rowKeys, side='right') - 1
+    first = firstRule[np.maximum(rowRates, 0)]
+    misdated = known & hasDate & ((ruleNo < first) | (seconds >= ruleEnds[np.maximum(ruleNo, first)]))
+    ruleNo = np.maximum(ruleNo, first)
+
+    taxKeys = np.array([rule['St-SL'] for rule in lTaxRules], dtype=object)
+    accountsServices = np.array([rule['Dienst'] for rule in lTaxRules], dtype=object)
+    accountsGoods = np.array([rule['Ware'] for rule in lTaxRules], dtype=object)
+    stsl = np.where(known, taxKeys[ruleNo], noTaxKey)
+    creditAccount = np.where(known, np.where(isService, accountsServices[ruleNo], accountsGoods[ruleNo]),
+        np.where(isService, getCreditAccountServices(noTaxKey), getCreditAccountGoods(noTaxKey)))
+
+    print ("\n### {}\n".format("Generiere ProSaldo Gegenkonten"))
+    print("Die folgenden Steuerschlüssel sind im Dataframe vorhanden: {}".format(pd.unique(stsl)))
+
+    changeLog = np.full(len(stsl), np.NaN, dtype=object)
+    changeLog[~known] = 'no tax key in input file'
+    for n, rate in enumerate(distinctRates):
+        flagged = misdated & (rowRates == n)
+        if flagged.any():
+            changeLog[flagged] = 'tax rate {} not valid on this date'.format(formatTaxRate(rate))
+            print("\tWARNUNG: MwSt-Satz {} in {} Buchungen außerhalb des Gültigkeitszeitraums (siehe Spalte ChangeLog)".format(
+                formatTaxRate(rate), int(flagged.sum())))
+    return stsl, creditAccount, changeLog
+
 # generator function to completely hide/abstract the iteration over the range of dates:
 
 def daterange(sdate, edate):
@@ -305,39 +1212,310 @@ def daterange(sdate, edate):
     for n in range(int((end_date - start_date).days)):
         yield start_date + dt.timedelta(n)
 
-# The values in Bon_Nummer should be increasing by zero or one
-# (same Bon or next Bon). The first value will be NaN.
-# If everything is OK then uniqueDiff should be [nan,  1.,  0. ]
-# if there are gap we will have [nan,  1.,  0.,  2.] or worse
+# Check the Bon numbers for gaps and for Bons with more than one DateTime
+# on the receipt table (see receiptTable and checkReceipts).
+# With reportInfile the report file is written.
+
+def checkBonNummer(da, reportInfile=None):
+
+    checkReceipts(receiptTable(da), reportInfile)
+
+# Order of a stable sort, missing values last. Used to sort with one take
+# instead of copying the whole dataframe for each sort. Equal values keep the
+# order of the rows, so the order does not depend on the number of rows
+# (streaming mode, incremental reloads of the server mode).
+
+def sortOrder(values):
+
+    mask = pd.isna(values)
+    if not mask.any():
+        return np.argsort(values, kind='stable')
+    valid = np.flatnonzero(~mask)
+    return np.concatenate([valid[np.argsort(values[valid], kind='stable')], np.flatnonzero(mask)])
+
+# Convert a column to a categorical with stripped and sorted categories (compact mode).
+# Only the categories are stripped, the rows are recoded with integer operations.
+# The categories are sorted, so that grouping and sorting by category codes
+# gives the same order as grouping and sorting by the strings.
+
+def compactColumn(values):
+
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype('category')
+    categories = values.cat.categories
+    if pd.api.types.is_string_dtype(categories.dtype):
+        categories = categories.str.strip()
+    newCodes, newCategories = pd.factorize(categories, sort=True)
+    codes = values.cat.codes.to_numpy()
+    codes = np.where(codes < 0, -1, np.append(newCodes, -1)[codes])
+    return pd.Series(pd.Categorical.from_codes(codes, categories=newCategories), index=values.index, name=values.name)
+
+# Memory used by a dataframe (options --compact and --verbose)
 
-def checkBonNummer(da):
+def printMemoryUsage(df):
+
+    usage = df.memory_usage(deep=True)
+    print("\n###### Speicherbedarf des Dataframes\n")
+    for name, size in usage.items():
+        print("{:<16} {:>10.2f} MB\t{}".format(str(name), size / 1024**2, df[name].dtype if name in df.columns else ''))
+    print("{:<16} {:>10.2f} MB".format('Summe', usage.sum() / 1024**2))
+
+# The values in Bon_Nummer should be increasing by one without gaps,
+# and all lines of a Bon should have the same DateTime.
+# The check works on the sorted unique Bon numbers, not on the line items:
+# the Bon numbers are kept as sorted list of ranges [first, last] without gaps,
+# the missing Bon numbers are the ranges between them.
+# The ranges of each chunk (streaming mode) are merged with the ranges found so far,
+# the number of ranges grows with the number of gaps only, not with the number of Bons.
+
+def bonRanges(bons):
+
+    u = np.unique(bons)
+    if u.size == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(u) > 1)
+    return np.column_stack((np.r_[u[0], u[breaks + 1]], np.r_[u[breaks], u[-1]]))
+
+def mergeBonRanges(ranges, other):
+
+    r = np.concatenate((ranges, other))
+    if r.shape[0] == 0:
+        return r
+    r = r[np.argsort(r[:, 0], kind='mergesort')]
+    lastEnd = np.maximum.accumulate(r[:, 1])
+    newRange = np.r_[True, r[1:, 0] > lastEnd[:-1] + 1]
+    starts = np.flatnonzero(newRange)
+    return np.column_stack((r[starts, 0], np.maximum.reduceat(r[:, 1], starts)))
+
+# First and last DateTime of each Bon, indexed by the sorted unique Bon numbers.
+# A Bon with first < last appears at more than one date or time, e.g. a Bon
+# number that was used again after a reset of the cash register.
+
+def bonTimes(bons, times):
+
+    times = times.astype('datetime64[ns]')
+    order = np.lexsort((times, bons))
+    bons, times = bons[order], times[order]
+    starts = np.flatnonzero(np.r_[True, bons[1:] != bons[:-1]])
+    ends = np.r_[starts[1:], bons.size] - 1
+    return pd.DataFrame({'Erster Zeitpunkt': times[starts], 'Letzter Zeitpunkt': times[ends]},
+        index=pd.Index(bons[starts], name='Bon_Nummer'))
+
+def mergeBonTimes(times, other):
+
+    if times is None:
+        return other
+    return pd.concat([times, other]).groupby(level=0, sort=True).agg({'Erster Zeitpunkt': 'min', 'Letzter Zeitpunkt': 'max'})
+
+def multipleBonTimes(times):
+
+    return times[times['Erster Zeitpunkt'] < times['Letzter Zeitpunkt']]
+
+# Print the missing Bon numbers as ranges (von, bis, Anzahl) and the Bons with
+# more than one DateTime. The console shows the first lBonReportRows rows of each,
+# the complete lists are written to the file _BonPruefung (option --bon-report).
+
+lBonReportRows = 20
+
+def reportBonRanges(ranges, multiple=None, reportInfile=None):
 
     print("\n###### Prüfe Bon Nummern auf Lücken\n")
-    df = da.copy() # deep copy of dataframe
-    df = df.sort_values(by=['Bon_Nummer'])
-    df['DiffBN'] = df['Bon_Nummer'].diff()
-    uniqueDiff = df['DiffBN'].unique()
-# remove expected values
-    plist = list(set(uniqueDiff) - set([ 0., 1.]))
-# plist contains [nan, 2.0] if we have gaps !
-    ngaps = 0
-    missingBons = []
-    for gap in plist:
-        if (not np.isnan(gap)):
-            mask = df['DiffBN'] == gap
-            dfgap = df[mask].copy() # all lines with gap
-            for i in dfgap.index:
-                missing = int(df.at[i, 'Bon_Nummer'] - gap + 1)
-                missingBons.append(missing)
-            print(dfgap)
-            ngaps += dfgap.shape[0] * abs(gap - 1)
+    gaps = pd.DataFrame({'von': ranges[:-1, 1] + 1, 'bis': ranges[1:, 0] - 1})
+    gaps['Anzahl'] = gaps['bis'] - gaps['von'] + 1
+    ngaps = int(gaps['Anzahl'].sum())
 
     if (ngaps > 0):
         print(f"\n###### WARNUNG: Es wurden {ngaps:.0f} Lücken in den Bon Nummern gefunden\n")
-        print(f"Die folgenden Bon Nummern fehlen: {missingBons}\n")
+        print(f"Die folgenden Bon Nummern fehlen ({gaps.shape[0]} Bereiche):\n")
+        printBonReport(gaps)
     else:
         print(f"\n###### OK: Es wurden keine Lücken in den Bon Nummern gefunden\n")
 
+    if multiple is None:
+        multiple = pd.DataFrame(columns=['Erster Zeitpunkt', 'Letzter Zeitpunkt'], index=pd.Index([], name='Bon_Nummer'))
+    if not multiple.empty:
+        print(f"\n###### WARNUNG: {multiple.shape[0]} Bon Nummern haben mehrere Zeitpunkte\n")
+        printBonReport(multiple.reset_index())
+
+    if reportInfile is not None:
+        gaps['Typ'] = 'Lücke'
+        multiple = multiple.reset_index().rename(columns={'Bon_Nummer': 'von'})
+        multiple['bis'] = multiple['von']
+        multiple['Anzahl'] = 1
+        multiple['Typ'] = 'Mehrere Zeitpunkte'
+        report = pd.concat([gaps, multiple], ignore_index=True)[['Typ', 'von', 'bis', 'Anzahl', 'Erster Zeitpunkt', 'Letzter Zeitpunkt']]
+        writeCSV(reportInfile, '_' + sxBonReport, report, csv.QUOTE_NONNUMERIC)
+
+def printBonReport(df):
+
+    print(df.head(lBonReportRows).to_string(index=False))
+    if df.shape[0] > lBonReportRows:
+        print("... und {} weitere".format(df.shape[0] - lBonReportRows))
+
+# Receipt table: one row per Bon, built from the line items with one sort by
+# Bon_Nummer and DateTime (as in bonTimes) and one reduceat per column.
+#   Zeilen              number of line items
+#   Zeilen Dienst       number of line items with 'Dst/Ware' == 'Dienst'
+#   Erster Zeitpunkt    first and last DateTime of the line items
+#   Letzter Zeitpunkt
+#   Umsatz Br.          Bon total as reported (see below)
+#   Summe Positionen    sum of 'Einzel VK Br.' x 'Anzahl' (with sign)
+#   Umsatz Dienst       Summe Positionen of the services and of the goods
+#   Umsatz Ware
+#   MwSt <St-SL>        tax per tax key as reported (0 without such lines)
+# 'Umsatz Br.' and 'MwSt' are amounts per line item, as in the product
+# statistics, and are summed per Bon. Some exports repeat the Bon total on
+# every line instead: a Bon with more than one line whose 'Umsatz Br.' is the
+# same on every line and equal to Summe Positionen takes the value of its
+# first line, and the tax of its first line per tax key. The decision is made
+# per Bon, so it does not depend on the rows read together (streaming mode,
+# incremental mode).
+# The amounts have the dtype of the line items (float or int64 cents).
+# The Bon checks and the Bon statistics of a period use this table instead of
+# the line items. It is cached together with the preprocessed dataframe.
+
+@stage('Bon Tabelle')
+def receiptTable(df):
+
+    bons = df['Bon_Nummer'].to_numpy()
+    times = df['DateTime'].to_numpy().astype('datetime64[ns]')
+    order = np.lexsort((times, bons))
+    bons, times = bons[order], times[order]
+    newBon = np.r_[True, bons[1:] != bons[:-1]] if bons.size else np.zeros(0, dtype=bool)
+    starts = np.flatnonzero(newBon)
+    ends = np.r_[starts[1:], bons.size][:starts.size] - 1
+
+    isService = (df['Dst/Ware'] == 'Dienst').to_numpy(dtype=bool, na_value=False)[order]
+    isCredit = df['Soll/Haben'].to_numpy(dtype=object)[order] == 'H'
+    amounts = df['Umsatz'].to_numpy()[order]
+    amounts = np.where(isCredit, -amounts, amounts)
+    positions = np.add.reduceat(amounts, starts) if starts.size else amounts[:0]
+    services = np.add.reduceat(np.where(isService, amounts, 0), starts) if starts.size else amounts[:0]
+    nLines = np.diff(np.r_[starts, bons.size])
+
+# Bon total repeated on every line or amounts per line (see above)
+
+    reported = df['Umsatz Br.'].to_numpy()[order]
+    if starts.size:
+        firstReported = reported[starts]
+        constant = np.minimum.reduceat(reported, starts) == np.maximum.reduceat(reported, starts)
+        difference = firstReported - positions
+        if not isCentColumn(df['Umsatz Br.']):
+            difference = np.round(difference, 2)
+        repeated = (nLines > 1) & constant & (difference == 0)
+        reported = np.where(repeated, firstReported, np.add.reduceat(reported, starts))
+    else:
+        repeated = np.zeros(0, dtype=bool)
+        reported = reported[:0]
+
+    receipts = pd.DataFrame({
+        'Zeilen': nLines,
+        'Zeilen Dienst': np.add.reduceat(isService.astype(np.int64), starts) if starts.size else np.zeros(0, dtype=np.int64),
+        'Erster Zeitpunkt': times[starts],
+        'Letzter Zeitpunkt': times[ends],
+        'Umsatz Br.': reported,
+        'Summe Positionen': positions,
+        'Umsatz Dienst': services,
+        'Umsatz Ware': positions - services
+        }, index=pd.Index(bons[starts], name='Bon_Nummer'))
+
+# tax per (Bon, St-SL): sum of the lines, or the first line if the Bon
+# total is repeated, the lines of a Bon are contiguous
+
+    keyCodes, keys = pd.factorize(df['St-SL'].to_numpy(dtype=object)[order], sort=True)
+    bonNo = np.cumsum(newBon) - 1
+    pairs, first = np.unique(bonNo * max(len(keys), 1) + keyCodes, return_index=True)
+    taxes = df['MwSt'].to_numpy()[order]
+    table = np.zeros((starts.size, len(keys)), dtype=taxes.dtype)
+    np.add.at(table, (bonNo, keyCodes), np.where(repeated[bonNo], 0, taxes))
+    isFirst = repeated[pairs // max(len(keys), 1)]
+    table[pairs[isFirst] // max(len(keys), 1), pairs[isFirst] % max(len(keys), 1)] = taxes[first[isFirst]]
+    for n, key in enumerate(keys):
+        receipts['MwSt ' + key] = table[:, n]
+
+    return receipts
+
+# Bon checks on the receipt table: gaps in the Bon numbers, Bons with more
+# than one DateTime (see reportBonRanges) and Bons whose reported total
+# 'Umsatz Br.' differs from the sum of the line items.
+
+@stage('Bon Prüfung')
+def checkReceipts(receipts, reportInfile=None):
+
+    times = receipts[['Erster Zeitpunkt', 'Letzter Zeitpunkt']]
+    reportBonRanges(bonRanges(receipts.index.to_numpy()), multipleBonTimes(times), reportInfile)
+
+    difference = receipts['Umsatz Br.'] - receipts['Summe Positionen']
+    if not isCentColumn(receipts['Umsatz Br.']):
+        difference = difference.round(2)
+    differs = difference.to_numpy() != 0
+    if differs.any():
+        print("\n###### HINWEIS: Bei {} Bons weicht Umsatz Br. von der Summe der Positionen ab\n".format(int(differs.sum())))
+        printBonReport(centsToEuro(receipts.loc[differs, ['Zeilen', 'Erster Zeitpunkt', 'Umsatz Br.', 'Summe Positionen']]).reset_index())
+
+# Date formats of the column 'Datum' in the GDPdU export.
+# For the syntax of the format string
+# see https://docs.python.org/3/library/datetime.html#strftime-and-strptime-behavior
+
+lDateFormats = [
+    '%d-%m-%y',     # format used in the latest version of KI-Kasse
+    '%d.%m.%Y',     # format used in Friseursoftware V4.8 by Kühnemann Informatik, 2017
+    '%d.%m.%y',
+    '%d-%m-%Y',
+    '%Y-%m-%d'
+]
+
+timeFormat = '%H:%M:%S'
+
+# Parse the distinct values of a date column.
+# The format is detected from lDateFormats: the first format that
+# matches all values is used. If there is no such format (e.g. an archive
+# with exports from different versions), each value is parsed with the
+# first format in lDateFormats that matches.
+# Returns a DatetimeIndex with NaT for values that do not match any format.
+
+def parseDates(values):
+
+    parsed = None
+    usedFormats = []
+    for format in lDateFormats:
+        dates = pd.to_datetime(values, format=format, errors='coerce')
+        if dates.notna().any():
+            usedFormats.append(format)
+            parsed = dates if parsed is None else parsed.where(parsed.notna(), dates)
+        if parsed is not None and parsed.notna().all():
+            break
+
+    print("\tDatumsformat: {}".format(' und '.join(usedFormats) if usedFormats else 'unbekannt'))
+    if parsed is None:
+        return pd.DatetimeIndex([pd.NaT] * len(values))
+    if parsed.isna().any():
+        print("\tWARNUNG: Die folgenden Datumswerte konnten nicht gelesen werden: {}".format(list(values[parsed.isna()])))
+    return parsed
+
+# Build the column 'DateTime' from the columns 'Datum' and 'Uhrzeit'.
+# There are only a few thousand distinct values in 'Datum' and at most
+# 86400 in 'Uhrzeit'. We parse the distinct values only, map them back to
+# the rows and add date and time (as offset since midnight) without
+# building a concatenated string for each row.
+
+@stage('DateTime Spalte')
+def buildDateTime(datum, uhrzeit):
+
+    dateCodes, dateValues = pd.factorize(datum)
+    timeCodes, timeValues = pd.factorize(uhrzeit)
+
+# the last element is used for missing values (code -1)
+
+    dates = np.append(parseDates(pd.Index(dateValues, dtype=object)).asi8, pd.NaT.value)
+    times = pd.to_datetime(pd.Index(timeValues, dtype=object), format=timeFormat)
+    times = np.append((times - times.normalize()).asi8, 0)
+
+    values = dates[dateCodes] + times[timeCodes]
+    values[(dates[dateCodes] == pd.NaT.value) | (timeCodes < 0)] = pd.NaT.value
+
+    return pd.Series(values.view('datetime64[ns]'), index=datum.index)
+
 # The following modificactions are made to the dataframe containing the GDPdU Export
 # 1.  strip whitespace from all strings
 # 2.  Convert column 'Anzahl' to datatype integer
@@ -355,24 +1533,30 @@ def checkBonNummer(da):
 #       'ChangeLog'
 # 5.  Fill column 'Umsatz' (datatype float). At this stage positive or negative
 # 6.  fill the column 'Soll/Haben' depending on column 'Umsatz'
-# 7.  fill the column 'St-SL' with ProSaldo tax rate identifier (Steuersatz)
-# 8.  fill column 'Gegenkonto' depending on 'St-SL' and 'Dst/Ware'
-# 9.  swap debit and credit account if debit credit indicator == "H"
-# 10. invert amount in column 'Umsatz' for transaction with debit credit indicator == "H"
+# 7.  fill column 'DateTime' with dtype datetime64 using the columns 'Datum' and 'Uhrzeit'
+# 8.  fill the column 'St-SL' with ProSaldo tax rate identifier (Steuersatz)
+# 9.  fill column 'Gegenkonto' depending on 'St-SL' and 'Dst/Ware'
+#     (with option --rules also depending on 'DateTime')
+# 10. swap debit and credit account if debit credit indicator == "H"
+# 11. invert amount in column 'Umsatz' for transaction with debit credit indicator == "H"
 #     after this step the column 'Umsatz' is always positive
-# 11. fill column 'DateTime' with dtype datetime64 using the columns 'Datum' and 'Uhrzeit'
 # create entries in 'ChangeLog' in case of irregularities
 
-def preprocessDataframe(da):
+@stage('Vorverarbeitung')
+def preprocessDataframe(da, checkBons: bool = True, reportInfile=None, money: str = 'float'):
 
 #    print(da.head())
 
-    df = da.copy() # deep copy of dataframe
+    df = da.copy(deep=False) # new columns and converted columns are not written into da
 
-# strip whitespace from strings
+# strip whitespace from strings, one column at a time
 
-    df_obj = df.select_dtypes(['string'])
-    df[df_obj.columns] = df_obj.apply(lambda x: x.str.strip())
+    with stage('Vorverarbeitung Text bereinigen'):
+        if not da.attrs.get('stripped', False):
+            for name in df.select_dtypes(['string']).columns:
+                df[name] = df[name].str.strip()
+            for name in df.select_dtypes(['category']).columns:
+                df[name] = compactColumn(df[name])
 
 # print stats
 
@@ -403,92 +1587,70 @@ def preprocessDataframe(da):
 
 # Convert column 'Anzahl' to datatype integer
 
-    convertColumnToInteger(df,'Anzahl')
-    convertColumnToInteger(df,'Bon_Nummer')
+    with stage('Vorverarbeitung Datentypen'):
+        convertColumnToInteger(df,'Anzahl')
+        convertColumnToInteger(df,'Bon_Nummer')
 
-# Convert columns 'Umsatz Br.' 'Einzel VK Br.' 'MwSt' to datatype float
+# Convert columns 'Umsatz Br.' 'Einzel VK Br.' 'MwSt' to datatype float (int64 cents with option --money)
 
-    convertColumnToFloat(df,'Umsatz Br.')
-    convertColumnToFloat(df,'Einzel VK Br.')
-    convertColumnToFloat(df,'MwSt')
+        for name in ['Umsatz Br.', 'Einzel VK Br.', 'MwSt']:
+            if money == 'float':
+                convertColumnToFloat(df, name)
+            else:
+                convertColumnToCents(df, name, verify=(money == 'verify'))
 
-# Fill column 'Umsatz' (datatype float). At this stage positive or negative
+# Fill column 'Umsatz' (datatype float or int64). At this stage positive or negative
 
-    df['Umsatz'] = df[["Einzel VK Br.", "Anzahl"]].product(axis=1)
+        if money == 'float':
+            df['Umsatz'] = df[["Einzel VK Br.", "Anzahl"]].product(axis=1)
+        else:
+            df['Umsatz'] = df['Einzel VK Br.'].to_numpy() * df['Anzahl'].to_numpy()
 
 # fill the column 'Soll/Haben' depending on column 'Umsatz'
 
-    df['Soll/Haben'] = np.where(df['Umsatz'] >= 0, "S", "H")
+        df['Soll/Haben'] = np.where(df['Umsatz'] >= 0, "S", "H")
 
-# fill the column 'St-SL' with ProSaldo tax rate identifier (Steuersatz)
-
-    print ("\n### {}\n".format("Generiere ProSaldo Steuerschlüssel"))
-
-    uniqueTaxRate = df['MwSt-Satz'].unique().to_numpy()
-    print("\tDie folgenden MwSt. Sätze sind im Dataframe vorhanden: {}\n".format(uniqueTaxRate))
-
-    for eKey in uniqueTaxRate:
-        pKey = getProSaldoTaxKey(eKey)
-        df.loc[df['MwSt-Satz'] == eKey, 'St-SL'] = pKey
-
-#  create an entry in ChangeLog that we have used a fall-back tax key.
-
-    df.loc[df['St-SL'] == noTaxKey, 'ChangeLog'] = 'no tax key in input file'
-
-    print ("\n### {}\n".format("Generiere ProSaldo Gegenkonten"))
-
-# fill column 'Gegenkonto' depending on 'St-SL' and 'Dst/Ware'
-# a. split transactions into service and others (goods)
-
-    mask = df['Dst/Ware'] == 'Dienst'
-    df_services = df[mask].copy()
-    df_goods = df[~mask].copy()
-
-    uniqueTaxKey = df['St-SL'].unique()
-    print("Die folgenden Steuerschlüssel sind im Dataframe vorhanden: {}".format(uniqueTaxKey))
+# create a column with dtype datetime64. For the syntax of the format string
+# see https://docs.python.org/3/library/datetime.html#strftime-and-strptime-behavior
+# The dates are needed for the rules with validity intervals (option --rules).
 
-# fill column 'Gegenkonto' depending on 'St-SL' for Services
+    print ("\n ### {}\n".format("Generiere kombinierte Date-Time Spalte "))
 
-    for eKey in uniqueTaxKey:
-        pAccount = getCreditAccountServices(eKey)
-        df_services.loc[df['St-SL'] == eKey, 'Gegenkonto'] = pAccount
+    df['DateTime'] = buildDateTime(df['Datum'], df['Uhrzeit'])
 
-# fill column 'Gegenkonto' depending on 'St-SL' for Goods
+# Hinweis: die Option mit infer_datetime_format=True ist erheblich langsamer!!
 
-    for eKey in uniqueTaxKey:
-        pAccount = getCreditAccountGoods(eKey)
-        df_goods.loc[df['St-SL'] == eKey, 'Gegenkonto'] = pAccount
+# fill the column 'St-SL' with ProSaldo tax rate identifier (Steuersatz)
+# and 'Gegenkonto' depending on 'St-SL' and 'Dst/Ware', with a rule file
+# (option --rules) depending on 'DateTime', too (see applyTaxRules)
 
-#   put the dataframes back together
+    print ("\n### {}\n".format("Generiere ProSaldo Steuerschlüssel"))
 
-    frames = [df_services, df_goods]
-    df = pd.concat(frames)
-    df = df.sort_index()
+    with stage('Vorverarbeitung Steuerschlüssel und Konten'):
+        isService = (df['Dst/Ware'] == 'Dienst').to_numpy(dtype=bool, na_value=False)
+        if lTaxRules:
+            stsl, creditAccount, changeLog = applyTaxRules(df['MwSt-Satz'], df['DateTime'], isService)
+        else:
+            stsl, creditAccount, changeLog = applyTaxDictionaries(df['MwSt-Satz'], isService)
+        df['St-SL'] = stsl
+        df['ChangeLog'] = changeLog
 
 #  swap debit and credit account if debit credit indicator == "H"
 
-    df[['Konto','Gegenkonto']] = df[['Gegenkonto','Konto']].where(df['Soll/Haben'] == 'H', df[['Konto','Gegenkonto']].values)
+        isCredit = df['Soll/Haben'].to_numpy() == 'H'
+        df['Konto'] = np.where(isCredit, creditAccount, defDebitAccountNo).astype(object)
+        df['Gegenkonto'] = np.where(isCredit, defDebitAccountNo, creditAccount).astype(object)
 
 #  invert amount in column 'Umsatz' for transaction with debit credit indicator == "H"
 
-    mask = df['Soll/Haben'] == 'H'
-    df.loc[mask, 'Umsatz'] = df['Umsatz'] * -1
-
-# create a column with dtype datetime64. For the syntax of the format string
-# see https://docs.python.org/3/library/datetime.html#strftime-and-strptime-behavior
-
-    print ("\n ### {}\n".format("Generiere kombinierte Date-Time Spalte "))
-
-#  format used in Friseursoftware V4.8 by Kühnemann Informatik, 2017
-#    df['DateTime'] = pd.to_datetime(df['Datum'] + ' ' + df['Uhrzeit'], format='%d.%m.%Y %H:%M:%S')
-#  the format has changed in the latest version
-    df['DateTime'] = pd.to_datetime(df['Datum'] + ' ' + df['Uhrzeit'], format='%d-%m-%y %H:%M:%S')
-
+        mask = df['Soll/Haben'] == 'H'
+        df.loc[mask, 'Umsatz'] = df['Umsatz'] * -1
 
+#  compact mode: store the derived columns as categoricals, too
 
-# Hinweis: die Option mit infer_datetime_format=True ist erheblich langsamer!!
-#
-#    df['DateTime'] = pd.to_datetime(df['Datum'] + ' ' + df['Uhrzeit'], infer_datetime_format=True)
+    if isinstance(da['Produkt'].dtype, pd.CategoricalDtype):
+        for name in lCompactDerived:
+            df[name] = compactColumn(df[name])
 
 #    print(df.head(10))
 
@@ -503,15 +1665,15 @@ def preprocessDataframe(da):
 
 #    print(df.columns.values.tolist())
 
-    checkBonNummer(df)
+    if checkBons:
+        checkBonNummer(df, reportInfile)
 
-# create index
+# create index: sort by Bon_Nummer, then by DateTime (sort_values, sort_index)
+# in one take, sort_index keeps the order if DateTime is already sorted
 
-    df = df.sort_values(by=['Bon_Nummer'])
-    df.index = pd.to_datetime(df['DateTime'], format='%d-%m-%y %H:%M:%S')
-    df = df.sort_index()
-    end_date = df.index[-1]
-    start_date = df.index[0]
+    with stage('Vorverarbeitung Sortieren'):
+        df = sortTransactions(df)
+    start_date, end_date = dateBounds(df.index)
     print(f"Startdate: {start_date}")
     print(f"Enddate:   {end_date}")
 
@@ -519,6 +1681,363 @@ def preprocessDataframe(da):
 
     return df
 
+def sortTransactions(df):
+
+    order = sortOrder(df['Bon_Nummer'].to_numpy())
+    dates = pd.DatetimeIndex(df['DateTime'].to_numpy()[order])
+    if not dates.is_monotonic_increasing:
+        order = order[sortOrder(dates.to_numpy())]
+    df = df.take(order)
+    df.index = pd.DatetimeIndex(df['DateTime'])
+    return df
+
+# Columnar store for dataframes on disk.
+# A store is a directory with one numpy file (.npy) per column and a file
+# meta.json that describes the columns and the index.
+# Numeric columns are stored as they are, datetime64 columns as int64 (ns).
+# Text columns ("string", object and category) are dictionary encoded:
+# the codes (-1 for missing values) are stored in the .npy file with the
+# integer type pandas uses for the codes of a categorical (see codeType),
+# the distinct values are stored sorted in meta.json.
+# Loading restores the original dtypes, so a loaded dataframe writes the
+# same CSV output as the dataframe that was stored. With mapped=True the
+# files are memory-mapped (read only) and text columns are loaded as
+# categories, so no column is copied (see openColumnStore).
+
+def codeType(nCategories):
+
+    for dtype in (np.int8, np.int16, np.int32):
+        if nCategories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+def encodeColumn(values):
+
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return {'kind': 'category', 'dtype': str(dtype.categories.dtype), 'categories': dtype.categories.tolist()}, values.cat.codes.to_numpy()
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return {'kind': 'datetime', 'dtype': str(dtype)}, values.to_numpy().view(np.int64)
+    if pd.api.types.is_string_dtype(dtype):
+        codes, uniques = pd.factorize(values, sort=True)
+        categories = list(uniques)
+        if not all(isinstance(v, str) for v in categories):
+            raise TypeError("Spalte {} enthält Werte, die keine Strings sind".format(values.name))
+        return {'kind': 'text', 'dtype': str(dtype), 'categories': categories}, codes.astype(codeType(len(categories)))
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+        return {'kind': 'numeric', 'dtype': str(dtype)}, values.to_numpy()
+    raise TypeError("Datentyp {} der Spalte {} wird nicht unterstützt".format(dtype, values.name))
+
+def decodeColumn(info, data, mapped: bool = False):
+
+    kind = info['kind']
+    if kind == 'numeric':
+        return data
+    if kind == 'datetime':
+        return data.view(info['dtype'])
+    categories = pd.Index(info['categories'], dtype=object)
+    values = pd.Categorical.from_codes(data, categories=categories)
+    if kind == 'category' or mapped:
+        return values
+    if info['dtype'] == 'object':
+        return np.asarray(values, dtype=object)
+    return pd.array(values.astype(object), dtype=info['dtype'])
+
+# A dataframe as meta data (dict) and a list of numpy arrays (one per column,
+# the index last). This is also used to pass dataframes between processes
+# (option --files) without pickling object columns.
+
+def encodeDataframe(df):
+
+    meta = {'format': cacheFormatVersion, 'rows': int(df.shape[0]), 'columns': []}
+    arrays = []
+    for name in df.columns:
+        info, data = encodeColumn(df[name])
+        info['name'] = name
+        meta['columns'].append(info)
+        arrays.append(data)
+    info, data = encodeColumn(df.index.to_series())
+    info['name'] = df.index.name
+    meta['index'] = info
+    arrays.append(data)
+    return meta, arrays
+
+def decodeDataframe(meta, arrays, mapped: bool = False):
+
+    columns = {}
+    for info, data in zip(meta['columns'], arrays):
+        columns[info['name']] = decodeColumn(info, data, mapped)
+    info = meta['index']
+    index = pd.Index(decodeColumn(info, arrays[-1], mapped), name=info['name'])
+    return pd.DataFrame(columns, index=index, columns=[info['name'] for info in meta['columns']], copy=False)
+
+def saveColumnStore(df, path):
+
+    meta, arrays = encodeDataframe(df)
+    os.makedirs(path, exist_ok=True)
+    for n, data in enumerate(arrays[:-1]):
+        np.save(os.path.join(path, 'c{}.npy'.format(n)), data)
+    np.save(os.path.join(path, 'index.npy'), arrays[-1])
+    with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+
+def loadColumnStore(path, mapped: bool = False):
+
+    with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    mmapMode = 'r' if mapped else None
+    arrays = [np.load(os.path.join(path, 'c{}.npy'.format(n)), mmap_mode=mmapMode) for n in range(len(meta['columns']))]
+    arrays.append(np.load(os.path.join(path, 'index.npy'), mmap_mode=mmapMode))
+    return decodeDataframe(meta, arrays, mapped)
+
+# Persistent cache of the preprocessed dataframe (option --cache)
+# The key of a cache entry is built from the input file (path, size and
+# modification time), the program version and all dictionaries that are used
+# during preprocessing. Changing one of them invalidates the entry.
+# Each entry is a directory with a columnar store (see saveColumnStore) per
+# table: the preprocessed dataframe ('enriched') and the receipt table ('receipts').
+# When the cache is larger than its limit, the entries that were used least
+# recently are removed.
+
+def cacheKey(infile, compact: bool = False, money: str = 'float'):
+
+    stat = os.stat(infile)
+    keyData = {
+        'file': os.path.abspath(infile),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'programVersion': programVersion,
+        'compact': compact,
+        'money': money,
+        'cacheFormat': cacheFormatVersion,
+        'config': configHash()
+    }
+    return hashlib.sha256(json.dumps(keyData, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Hash of the dictionaries and defaults that determine the preprocessed data
+
+def configHash():
+
+    configData = {
+        'requiredFields': dRequiredFields,
+        'taxKey': dTaxKey,
+        'service': dCAService,
+        'goods': dCAGoods,
+        'defaults': [defTaxKey, noTaxKey, defAccountNo, defDebitAccountNo],
+        'rules': lTaxRules
+    }
+    return hashlib.sha256(json.dumps(configData, sort_keys=True).encode('utf-8')).hexdigest()
+
+def directorySize(path):
+
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+# Remove the least recently used entries until the cache fits into maxBytes.
+# The entry just stored (keep) is never removed, even if it alone exceeds the limit.
+
+def pruneCache(cacheDir, maxBytes, keep=None):
+
+    entries = []
+    for name in os.listdir(cacheDir):
+        path = os.path.join(cacheDir, name)
+        if os.path.isdir(path) and not name.startswith('.'):
+            entries.append((os.path.getmtime(path), directorySize(path), path))
+
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if os.path.basename(path) == keep:
+            if size > maxBytes:
+                print("\tWARNUNG: Der Cache Eintrag ist mit {:.1f} MB größer als --cache-size ({:.1f} MB)".format(size / 1024 / 1024, maxBytes / 1024 / 1024))
+            continue
+        if total <= maxBytes:
+            break
+        print("\tCache Eintrag wird entfernt: {}".format(os.path.basename(path)))
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+@stage('Cache laden')
+def loadCachedDataframe(cacheDir, key, table='enriched'):
+
+    path = os.path.join(cacheDir, key)
+    if not os.path.isfile(os.path.join(path, table, 'meta.json')):
+        return None
+    try:
+        df = loadColumnStore(os.path.join(path, table))
+    except Exception:
+        print("\tWARNUNG: Cache Eintrag {} konnte nicht gelesen werden: {}".format(key, sys.exc_info()[1]))
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+    os.utime(path) # Zeitpunkt der letzten Verwendung
+    return df
+
+@stage('Cache speichern')
+def storeCachedDataframe(cacheDir, key, tables, maxBytes):
+
+    path = os.path.join(cacheDir, key)
+    try:
+        os.makedirs(path, exist_ok=True)
+        for table, df in tables.items():
+            tmpPath = tempfile.mkdtemp(prefix='.' + table, dir=path)
+            saveColumnStore(df, tmpPath)
+            shutil.rmtree(os.path.join(path, table), ignore_errors=True)
+            os.rename(tmpPath, os.path.join(path, table))
+        os.utime(path)
+    except Exception:
+        print("\tWARNUNG: Dataframe konnte nicht im Cache gespeichert werden: {}".format(sys.exc_info()[1]))
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    print("\nVorverarbeitete Daten im Cache gespeichert: {}".format(path))
+    pruneCache(cacheDir, maxBytes, keep=key)
+
+# Read and preprocess the GDPdU export, use the cache if requested.
+# Returns the preprocessed dataframe and its receipt table (see receiptTable),
+# both are cached (tables 'enriched' and 'receipts'). The Bon checks run on
+# the receipt table, also for data from the cache.
+# Warm mode (option --jobs): the preprocessed dataframe and the receipt table
+# of the last export are kept in memory and used again for the same export
+# (same file, size, modification time and options --compact and --money).
+
+dWarmData = {'enabled': False, 'key': None, 'dfp': None, 'receipts': None}
+
+def readEnrichedDataframe(args):
+
+    reportInfile = args.file if args.bon_report else None
+    warmKey = None
+    if dWarmData['enabled'] and os.path.isfile(args.file):
+        warmKey = cacheKey(args.file, args.compact, args.money)
+        if warmKey == dWarmData['key']:
+            print("\nVorverarbeitete Daten aus dem Speicher übernommen: {}".format(args.file))
+            print("Gesamt Anz. Transaktionen\t {:>8d}".format(dWarmData['dfp'].shape[0]))
+            checkReceipts(dWarmData['receipts'], reportInfile)
+            return dWarmData['dfp'], dWarmData['receipts']
+
+    dfp, receipts = loadEnrichedDataframe(args)
+    checkReceipts(receipts, reportInfile)
+
+    if warmKey is not None:
+        dWarmData['key'], dWarmData['dfp'], dWarmData['receipts'] = warmKey, dfp, receipts
+    return dfp, receipts
+
+# Read and preprocess the GDPdU export or load it from the cache (option --cache),
+# without the Bon checks. Returns the preprocessed dataframe and its receipt table.
+
+def loadEnrichedDataframe(args):
+
+    dfp = receipts = None
+    if args.cache:
+        key = cacheKey(args.file, args.compact, args.money)
+        dfp = loadCachedDataframe(args.cache_dir, key)
+        if dfp is not None:
+            receipts = loadCachedDataframe(args.cache_dir, key, 'receipts')
+            print("\nVorverarbeitete Daten aus dem Cache geladen: {}".format(os.path.join(args.cache_dir, key)))
+            print("Gesamt Anz. Transaktionen\t {:>8d}".format(dfp.shape[0]))
+
+    if dfp is None:
+        dfp = preprocessDataframe(readCSV(args.file, args.compact, args.engine), checkBons=False, money=args.money)
+        if args.compact or args.verbose:
+            printMemoryUsage(dfp)
+    if receipts is None:
+        receipts = receiptTable(dfp)
+        if args.cache:
+            storeCachedDataframe(args.cache_dir, key, {'enriched': dfp, 'receipts': receipts}, args.cache_size * 1024 * 1024)
+    return dfp, receipts
+
+# Memory-mapped columnar store (command convert, option -f STORE)
+# convert reads and preprocesses a GDPdU export once and writes the
+# preprocessed dataframe ('enriched') and its receipt table ('receipts') as
+# columnar stores (see saveColumnStore) into the directory STORE. The file
+# store.json holds the name of the export, the money mode (option --money)
+# and the configuration the data was preprocessed with.
+# The rows are sorted by DateTime, missing dates last (see preprocessDataframe).
+# With -f STORE the columns are memory-mapped instead of parsing the CSV file:
+# numeric and date columns are used without a copy, text columns are
+# categories whose codes are memory-mapped as well. A period is selected by a
+# binary search on the DateTime index and is a slice of the mapped columns,
+# so the postings and statistics of a period only read the pages of its rows.
+# The output files are written next to the store, named after the export.
+
+storeFormatVersion = 2
+
+def isColumnStore(path):
+
+    return os.path.isfile(os.path.join(path, 'store.json'))
+
+def storeFileName(infile):
+
+    return os.path.splitext(infile)[0] + '_' + sxColumnStore
+
+@stage('Spaltenspeicher schreiben')
+def writeColumnStore(infile, store, dfp, receipts, money: str = 'float'):
+
+    storeData = {
+        'format': storeFormatVersion,
+        'source': os.path.basename(infile),
+        'rows': int(dfp.shape[0]),
+        'money': money,
+        'programVersion': programVersion,
+        'config': configHash()
+    }
+    tmpPath = tempfile.mkdtemp(prefix='.' + os.path.basename(os.path.normpath(store)), dir=os.path.dirname(os.path.abspath(store)))
+    try:
+        saveColumnStore(dfp, os.path.join(tmpPath, 'enriched'))
+        saveColumnStore(receipts, os.path.join(tmpPath, 'receipts'))
+        with open(os.path.join(tmpPath, 'store.json'), 'w', encoding='utf-8') as f:
+            json.dump(storeData, f, indent=1)
+        shutil.rmtree(store, ignore_errors=True)
+        os.rename(tmpPath, store)
+    except Exception:
+        shutil.rmtree(tmpPath, ignore_errors=True)
+        raise
+
+@stage('Spaltenspeicher öffnen')
+def openColumnStore(store):
+
+    with open(os.path.join(store, 'store.json'), encoding='utf-8') as f:
+        storeData = json.load(f)
+    if storeData.get('format') != storeFormatVersion:
+        print("Fehler: Der Spaltenspeicher {} hat ein anderes Format, bitte mit convert neu erstellen.".format(store))
+        exit(1)
+    if storeData['config'] != configHash():
+        print("WARNUNG: Der Spaltenspeicher {} wurde mit anderen Steuerschlüsseln und Kontenrahmen erstellt (Version {}, Option --rules), bitte mit convert neu erstellen.".format(store, storeData['programVersion']))
+    dfp = loadColumnStore(os.path.join(store, 'enriched'), mapped=True)
+    receipts = loadColumnStore(os.path.join(store, 'receipts'), mapped=True)
+    stageRows(rowsOut=dfp)
+    return storeData, dfp, receipts
+
+def convertExport(args):
+
+    store = args.output if args.output is not None else storeFileName(args.file)
+    if os.path.exists(store) and not isColumnStore(store):
+        print("Fehler: {} existiert und ist kein Spaltenspeicher.".format(store))
+        exit(1)
+
+    dfp = preprocessDataframe(readCSV(args.file, engine=args.engine), checkBons=False, money=args.money)
+    receipts = receiptTable(dfp)
+    checkReceipts(receipts)
+    writeColumnStore(args.file, store, dfp, receipts, args.money)
+    print("\nSpaltenspeicher geschrieben: {} ({} Zeilen, {:.1f} MB)".format(store, dfp.shape[0], directorySize(store) / 2**20))
+
+def analyzeColumnStore(args):
+
+    if (args.chunksize is not None) or args.incremental or args.cache:
+        print("Die Optionen --chunksize, --incremental und --cache können nicht mit einem Spaltenspeicher verwendet werden.")
+        exit(1)
+
+    storeData, dfp, receipts = openColumnStore(args.file)
+    if (args.money != 'float') and (storeData['money'] == 'float'):
+        print("Fehler: Der Spaltenspeicher {} enthält die Beträge als float, für --money {} mit convert --money cents neu erstellen.".format(args.file, args.money))
+        exit(1)
+    print("\nSpaltenspeicher geöffnet: {} (GDPdU Export {}, Beträge: {})".format(args.file, storeData['source'], storeData['money']))
+    print("Gesamt Anz. Transaktionen\t {:>8d}".format(dfp.shape[0]))
+
+    args = fileArguments(args, os.path.join(os.path.dirname(os.path.normpath(args.file)), storeData['source']))
+    checkReceipts(receipts, args.file if args.bon_report else None)
+    analyzeDataframe(args, dfp, receipts)
+
 # Purpose of collectivePostings: generate collective postings for income accounts
 # Assumption: PreProcessing has been done
 # Output:   CSV file with summary postings.
@@ -563,6 +2082,86 @@ def preprocessDataframe(da):
 # Wenn das Flag writeTX gesetzt ist (durch die verbose option)
 # wird auch eine CSV Datei mit den selektierten Transaktionen geschrieben.
 
+#
+# Implementation: all collective postings are created by one groupby over
+# ('Soll/Haben', 'Konto', 'Gegenkonto', 'St-SL'). The posting account of a
+# transaction is 'Gegenkonto' for 'H' and 'Konto' for 'S'. The output order
+# is the same as with the former loop over the accounts of each side:
+# 'H' before 'S', posting account ascending, then the remaining keys ascending.
+# The transactions (dftx) are taken from df with one stable sort by
+# side and posting account, i.e. the original order within each account is kept.
+
+cpKeys = ['Soll/Haben', 'Konto', 'Gegenkonto', 'St-SL']
+
+def postingAccount(df):
+
+    return np.where(df['Soll/Haben'].to_numpy(dtype=object) == 'H', df['Gegenkonto'].to_numpy(dtype=object), df['Konto'].to_numpy(dtype=object))
+
+def sortedPostingTransactions(df, leadCodes=None):
+
+    sideCodes, _ = pd.factorize(df['Soll/Haben'], sort=True)
+    accountCodes, _ = pd.factorize(postingAccount(df), sort=True)
+    if leadCodes is None:
+        order = np.lexsort((accountCodes, sideCodes))
+    else:
+        order = np.lexsort((accountCodes, sideCodes, leadCodes))
+    return df.iloc[order]
+
+def sortPostings(dfcp, leadNames=()):
+
+#   groupby(sort=False) orders categories by appearance, restore the sorted categories
+    for name in dfcp.select_dtypes(['category']).columns:
+        dfcp[name] = compactColumn(dfcp[name])
+
+    dfcp['Buchungskonto'] = postingAccount(dfcp)
+    return dfcp.sort_values(by=list(leadNames) + ['Soll/Haben', 'Buchungskonto', 'Konto', 'Gegenkonto', 'St-SL'], kind='mergesort')
+
+def groupPostings(df, leadKeys=()):
+
+    dfcp = df.groupby(list(leadKeys) + cpKeys, sort=False, observed=True).agg(Betrag=('Umsatz', "sum")).reset_index()
+    leadNames = [key if isinstance(key, str) else key.name for key in leadKeys]
+    return sortPostings(dfcp, leadNames)
+
+def printCollectivePostings(dfcp, side, nTx):
+
+    if side == 'H':
+        sideName, accountName, title = 'Haben', 'Gegenkonto', 'Haben-Sammelbuchungen'
+    else:
+        sideName, accountName, title = 'Soll', 'Konto', 'Soll-Sammelbuchungen'
+
+    dfside = dfcp[dfcp['Soll/Haben'] == side]
+    print("\n###### {}-Transaktionen\n".format(sideName))
+    print("Gesamt Anz. {} Transaktionen\t {:>8d}".format(sideName, nTx))
+
+    for eKto, df_salden in dfside.groupby(accountName, sort=True, observed=True):
+        print("\n###### {} Konto {}\n".format(title, eKto))
+        df_salden = df_salden[['Konto', 'Gegenkonto', 'St-SL', 'Betrag']].reset_index(drop=True)
+        total = df_salden['Betrag'].sum()
+        if isCentColumn(df_salden['Betrag']):
+            total = total / 100
+        print(centsToEuro(df_salden))
+        print("\n{: >8}{: >10}\t\t{:.2f}".format('Summe', eKto, total))
+
+# Create the output columns from the grouped and sorted collective postings.
+# firsttx is the timestamp of the first transaction, nH and nTx are the
+# number of 'H' transactions and of all transactions (for the verbose output).
+
+def formatCollectivePostings(postingText, heading, dfcp, firsttx, nH, nTx, verbose: bool = False):
+
+    if verbose:
+        printCollectivePostings(dfcp, 'H', nH)
+        printCollectivePostings(dfcp, 'S', nTx - nH)
+
+    dfcp = dfcp[['Konto', 'Gegenkonto', 'St-SL', 'Betrag']].reset_index(drop=True)
+
+#   Create new colums
+
+    dfcp['Datum'] = firsttx.strftime('%d.%m.%Y')
+    dfcp['Text'] = postingText + heading
+
+    return dfcp
+
+@stage('Sammelbuchungen')
 def collectivePostings(postingText, heading, df, verbose: bool = False):
 
     dftx = pd.DataFrame() # creates a new dataframe that's empty
@@ -571,181 +2170,1031 @@ def collectivePostings(postingText, heading, df, verbose: bool = False):
     if not df.empty:
 
         firsttx = df.index[0] # timestamp of first transaction in dataframe
+        nH = int((df['Soll/Haben'] == 'H').sum()) if verbose else 0
 
-        # process subset of transactions with 'Soll/Haben' == 'H'
-
-        mask = df['Soll/Haben'] == 'H'
-        dfh = df[mask].copy()
-        if verbose:
-            print("\n###### Haben-Transaktionen\n")
-            print("Gesamt Anz. Haben Transaktionen\t {:>8d}".format( dfh.shape[0]))
-        uniqueHKonto = dfh['Gegenkonto'].unique()
-        uniqueHKonto = np.sort(uniqueHKonto)
-
-        for eKto in uniqueHKonto:
-            is_eKto = dfh['Gegenkonto']==eKto
-            df_eKto = dfh[is_eKto].copy()
-            dftx = dftx.append(df_eKto)
-            df_salden = df_eKto.groupby(['Konto','St-SL']).agg({'Umsatz': "sum"}).reset_index()
-
-            if not df_salden.empty:
-                if verbose:
-                    print("\n###### Haben-Sammelbuchungen Konto {}\n".format(eKto))
-                total = df_salden['Umsatz'].sum()
-                df_salden.insert(1, 'Gegenkonto', eKto)
-                df_salden = df_salden.rename(columns={"Umsatz": "Betrag"}, errors="raise")
-                if verbose:
-                    print(df_salden)
-                    print("\n{: >8}{: >10}\t\t{:.2f}".format('Summe', eKto, total))
-                dfcp = dfcp.append(df_salden, ignore_index = True) # Gegenkonto soll erhalten bleiben!
-
-        # process subset of transactions with 'Soll/Haben' == 'S'
-#        dfs = df[~mask].copy()     # could also use inverted mask
-
-        mask = df['Soll/Haben'] == 'S'
-        dfs = df[mask].copy()
-        if verbose:
-            print("\n###### Soll-Transaktionen\n")
-            print("Gesamt Anz. Soll Transaktionen\t {:>8d}".format( dfs.shape[0]))
-        uniqueSKonto = dfs['Konto'].unique()
-        uniqueSKonto = np.sort(uniqueSKonto)
-
-        for eKto in uniqueSKonto:
-            is_eKto = dfs['Konto']==eKto
-            df_eKto = dfs[is_eKto].copy()
-            dftx = dftx.append(df_eKto)
-            df_salden = df_eKto.groupby(['Gegenkonto','St-SL']).agg({'Umsatz': "sum"}).reset_index()
-
-            if not df_salden.empty:
-                if verbose:
-                    print("\n###### Soll-Sammelbuchungen Konto {}\n".format(eKto))
-                total = df_salden['Umsatz'].sum()
-                df_salden.insert(0, 'Konto', eKto)
-                df_salden = df_salden.rename(columns={"Umsatz": "Betrag"}, errors="raise")
-                if verbose:
-                    print(df_salden)
-                    print("\n{: >8}{: >10}\t\t{:.2f}".format('Summe', eKto, total))
-                dfcp = dfcp.append(df_salden, ignore_index = True) # Gegenkonto soll erhalten bleiben!
-
-        dfcp = dfcp.sort_index()
-
-    #   Create new colums
-
-        dfcp['Datum'] = firsttx.strftime('%d.%m.%Y')
-        dfcp['Text'] = postingText + heading
+        dfcp = formatCollectivePostings(postingText, heading, groupPostings(df), firsttx, nH, df.shape[0], verbose)
+        dftx = sortedPostingTransactions(df)
 
     return dfcp, dftx
 
 
-# Select a subset of the dataframe that is between two Date
-# Note: The PreProcessing must run before to create the
-# df['DateTime'] column
+# Collective postings for each day in one pass (option --daily)
+# A transaction belongs to day D if D 00:00:00 < DateTime <= D+1 00:00:00,
+# this is the interval selectReceiptDate uses for a single day.
+# Days are numbered since the epoch and are a leading key of the groupby.
+# Days without transactions are still reported on the console.
+# Output is the same as running collectivePostings for every day
+# with the heading ' YYYY-MM-DD' and appending the results.
 
-def selectReceiptDate(df, start_date, end_date):
+nsPerDay = 86400 * 10**9
 
-# Make a boolean mask.
-# start_date and end_date can be datetime.datetimes, np.datetime64s, pd.Timestamps, or even datetime strings:
-# greater than the start date and smaller than the end date
+# First and last DateTime of the sorted index of a dataframe. Rows with an
+# unreadable date (NaT, see buildDateTime) are sorted last and are skipped,
+# (None, None) if no row has a date.
 
-    format = "%Y-%m-%d"
+def dateBounds(index):
 
-    try:
-        dt.datetime.strptime(start_date, format)
-    except ValueError:
-        print("\tStart Date {} format is incorrect. It should be YYYY-MM-DD".format(start_date))
-        exit(1)
+    dates = index.dropna()
+    if dates.empty:
+        return None, None
+    return dates[0], dates[-1]
+
+# bounds (first, last) widened by the dates of index (streaming mode)
+
+def widenBounds(bounds, index):
+
+    first, last = dateBounds(index)
+    if first is None:
+        return bounds
+    if bounds[0] is None:
+        return first, last
+    return min(bounds[0], first), max(bounds[1], last)
+
+# Rows without a date have no day, they are left out of the daily postings
+# and the daily sales statistics.
+
+def datedRows(df):
+
+    if not df.index.hasnans:
+        return df
+    isDated = df.index.notna()
+    print("\tWARNUNG: {} Transaktionen ohne gültiges Datum werden nicht berücksichtigt".format(int((~isDated).sum())))
+    return df[isDated]
+
+def dayRange(first, last):
+
+    timestamp = last + dt.timedelta(days=1)
+    end_date  = timestamp.replace(hour=0, minute=0, second=0)
+    start_date = first.replace(hour=0, minute=0, second=0)
+    print(f"\tStartdate: {start_date}")
+    print(f"\tEnddate:   {end_date}\n")
+    return start_date, end_date
+
+def dayNumber(index):
+
+    return (index.asi8 - 1) // nsPerDay
+
+# Create the output columns from the daily collective postings (column 'Tag'),
+# firstTx, nTx and nH are Series indexed by the day number with the
+# first transaction, the number of transactions and of 'H' transactions.
+
+def formatDailyPostings(postingText, dfcp, firstTx, nTx, nH, start_date, end_date, verbose: bool = False):
+
+    dfc = pd.DataFrame() # creates a new dataframe that's empty
+
+    firstDay = start_date.value // nsPerDay
+    nDays = int((end_date - start_date).days)
+    days = np.arange(firstDay, firstDay + nDays)
+
+    dfcp = dfcp[(dfcp['Tag'] >= firstDay) & (dfcp['Tag'] < firstDay + nDays)]
+    nPostings = np.bincount(dfcp['Tag'].to_numpy(dtype=np.int64) - firstDay, minlength=nDays)
+
+    if verbose:
+        nTx = nTx.reindex(days, fill_value=0).to_numpy()
+        nH = nH.reindex(days, fill_value=0).to_numpy()
+        dayBounds = np.searchsorted(dfcp['Tag'].to_numpy(), np.arange(firstDay, firstDay + nDays + 1))
+
+    for n, sdate in enumerate(daterange(start_date, end_date)):
+        edate = sdate + dt.timedelta(days=1)
+        print(f"from {sdate} to {edate}:", end='')
+        if verbose and nTx[n] > 0:
+            dfcp_daily = dfcp.iloc[dayBounds[n]:dayBounds[n + 1]]
+            printCollectivePostings(dfcp_daily, 'H', int(nH[n]))
+            printCollectivePostings(dfcp_daily, 'S', int(nTx[n] - nH[n]))
+        if nPostings[n] > 0:
+            print(f"{nPostings[n]} Sammelbuchungen ", end='\r')
+        else:
+            print(f"0 Sammelbuchungen!", end='\r')
+
+    if not dfcp.empty:
+        dfc = dfcp[['Konto', 'Gegenkonto', 'St-SL', 'Betrag']].reset_index(drop=True)
+        dfc['Datum'] = pd.DatetimeIndex(firstTx.reindex(dfcp['Tag'])).strftime('%d.%m.%Y')
+        dfc['Text'] = postingText + ' ' + pd.to_datetime(dfcp['Tag'].to_numpy(dtype=np.int64) * nsPerDay).strftime('%Y-%m-%d')
+
+    print(f"\n\nTägliche Sammelbuchungen von {start_date} bis {end_date} wurden erzeugt\n")
+
+    return dfc
+
+@stage('Tägliche Sammelbuchungen')
+def dailyCollectivePostings(postingText, df, verbose: bool = False):
+
+    dfc = pd.DataFrame() # creates a new dataframe that's empty
+    dfi = pd.DataFrame() # creates a new dataframe that's empty
+
+    if df.empty:
+        print("\tKeine Transaktionen im Zeitraum\n")
+        return dfc, dfi
+
+    df = datedRows(df)
+    if df.empty:
+        print("\tKeine Transaktionen mit Datum im Zeitraum\n")
+        return dfc, dfi
+
+    start_date, end_date = dayRange(*dateBounds(df.index))
+
+    dayNo = dayNumber(df.index)
+    inRange = dayNo >= start_date.value // nsPerDay
+    if not inRange.all():
+        df = df[inRange]
+        dayNo = dayNo[inRange]
+
+    tag = pd.Series(dayNo, index=df.index, name='Tag')
+    dfcp = groupPostings(df, [tag])
+
+    days, firstRow = np.unique(dayNo, return_index=True)
+    firstTx = pd.Series(df.index[firstRow], index=days)
+    nTx = tag.value_counts()
+    nH = tag[(df['Soll/Haben'] == 'H').to_numpy()].value_counts()
+
+    dfc = formatDailyPostings(postingText, dfcp, firstTx, nTx, nH, start_date, end_date, verbose)
+    if not df.empty:
+        dfi = sortedPostingTransactions(df, dayNo).reset_index(drop=True)
+
+    return dfc, dfi
+
+# Select a subset of the dataframe that is between two Date
+# Note: The PreProcessing must run before to create the sorted
+# DatetimeIndex (column 'DateTime')
+# A period selects DateTime > start_date 00:00:00 & DateTime <= end_date 00:00:00.
+# The positions of all periods are found with one binary search on the
+# sorted index (searchsorted), each period is returned as a slice of df
+# (a view, no copy). Missing DateTime values (NaT) are sorted last and never
+# selected. If the index is not sorted, a boolean mask is used instead.
+# start_date and end_date can be strings (YYYY-MM-DD) or timestamps.
+# The format of the strings from the command line is checked once by checkPeriods.
+
+def checkDate(date, name):
 
     try:
-        dt.datetime.strptime(end_date, format)
+        dt.datetime.strptime(date, "%Y-%m-%d")
     except ValueError:
-        print("\tEnd Date   {} format is incorrect. It should be YYYY-MM-DD".format(end_date))
+        print("\t{} {} format is incorrect. It should be YYYY-MM-DD".format(name, date))
         exit(1)
 
-    mask = (df['DateTime'] > start_date) & (df['DateTime'] <= end_date)
-    dfp = df.loc[mask].copy()
-    return dfp
+def checkPeriods(periods):
 
-#
+    for start_date, end_date in periods:
+        checkDate(start_date, 'Start Date')
+        checkDate(end_date, 'End Date  ')
+
+@stage('Periode auswählen')
+def selectPeriods(df, periods):
+
+    starts = pd.DatetimeIndex([pd.Timestamp(start_date) for start_date, end_date in periods])
+    ends = pd.DatetimeIndex([pd.Timestamp(end_date) for start_date, end_date in periods])
+
+    index = df.index
+    nValid = len(index) - int(index.isna().sum())
+    valid = index[:nValid]
+    if valid.hasnans or not valid.is_monotonic_increasing:
+        return [df.loc[(index > start_date) & (index <= end_date)] for start_date, end_date in zip(starts, ends)]
 
-def dailySalesByProduct(df, listOfProducts):
+    first = valid.searchsorted(starts, side='right')
+    last = valid.searchsorted(ends, side='right')
+    return [df.iloc[lo:max(lo, hi)] for lo, hi in zip(first, last)]
+
+def selectReceiptDate(df, start_date, end_date):
+
+    return selectPeriods(df, [(start_date, end_date)])[0]
+
+# Sales statistics are answered from a cube (day x product) that is built
+# with one groupby over all transactions. The cube holds the sums of
+# 'Umsatz Br.' and 'Anzahl' and the weekday (Montag = 0) for every
+# combination of day and product that occurs in the dataframe.
+# The day is numbered since the epoch, with the same interval
+# D 00:00:00 < DateTime <= D+1 00:00:00 as in dailyCollectivePostings.
+# Any list of products is selected from the cube with a reindex,
+# products without sales get zero entries.
+
+def salesByProductCube(df):
+
+    df = datedRows(df)
+    tag = pd.Series(dayNumber(df.index), index=df.index, name='Tag')
+    cube = df.groupby([tag, 'Produkt'], sort=True, observed=True)[['Umsatz Br.', 'Anzahl']].sum()
+    return addWeekday(cube)
+
+def addWeekday(cube):
+
+    cube['Wochentag'] = (cube.index.get_level_values('Tag') + 3) % 7 # 01.01.1970 war ein Donnerstag
+    return cube
+
+# bounds (first and last transaction) are only needed without df (streaming mode)
+
+def dailySalesByProduct(df, listOfProducts, cube=None, bounds=None):
 
     print ("\n###### Statistik für Top-Produkte für jeden Tag erzeugen:\n")
 
     columnNames = ['Produkt', 'Datum', 'Wochentag', 'Umsatz Br.', 'Anzahl']
-    dfs = pd.DataFrame(columns = columnNames)
+    if bounds is None:
+        bounds = dateBounds(df.index)
+    if bounds[0] is None:
+        return pd.DataFrame(columns = columnNames)
+
+    if cube is None:
+        cube = salesByProductCube(df)
     iProducts = np.sort(listOfProducts)
 
-    timestamp = df.index[-1] + dt.timedelta(days=1)
-    end_date  = timestamp.replace(hour=0, minute=0, second=0)
-    timestamp = df.index[0]
-    start_date = timestamp.replace(hour=0, minute=0, second=0)
-    print(f"\tStartdate: {start_date}")
-    print(f"\tEnddate:   {end_date}\n")
+    start_date, end_date = dayRange(*bounds)
 
-    for sdate in daterange(start_date, end_date):
-        edate = sdate + dt.timedelta(days=1)
-        strEndDate = edate.strftime('%Y-%m-%d')
-        strStartDate = sdate.strftime('%Y-%m-%d')
-        df_daily = selectReceiptDate(df, strStartDate, strEndDate)
-
-        for ePro in iProducts:
-            mask = df_daily['Produkt']==ePro # Produkt Name
-            df_ePro = df_daily.loc[mask].copy()
-            nTx = df_ePro['Anzahl'].sum()
-            total = df_ePro['Umsatz Br.'].sum()
-
-            d = {}
-            d["Produkt"] = ePro
-            d["Datum"] = sdate.strftime('%d.%m.%Y')
-            d["Wochentag"] = sdate.dayofweek # Montag = 0
-            d["Umsatz Br."] = total
-            d["Anzahl"] = nTx
-            dfs = dfs.append(d, ignore_index=True)         #append row to the dataframe
+    firstDay = start_date.value // nsPerDay
+    days = np.arange(firstDay, firstDay + int((end_date - start_date).days))
+    grid = pd.MultiIndex.from_product([days, iProducts], names=['Tag', 'Produkt'])
+    dfgrid = cube[['Umsatz Br.', 'Anzahl']].reindex(grid, fill_value=0)
+
+    dfs = pd.DataFrame({
+        'Produkt': np.tile(iProducts, len(days)),
+        'Datum': np.repeat(pd.to_datetime(days * nsPerDay).strftime('%d.%m.%Y').to_numpy(), len(iProducts)),
+        'Wochentag': np.repeat((days + 3) % 7, len(iProducts)),
+        'Umsatz Br.': dfgrid['Umsatz Br.'].to_numpy(),
+        'Anzahl': dfgrid['Anzahl'].to_numpy()
+        }, columns = columnNames)
 
     print(f"Statistik für Top-Produkte wurde erzeugt.\n")
 
     return dfs
 
-def totalSalesByProduct(df, listOfProducts):
+def totalSalesByProduct(df, listOfProducts, cube=None):
 
-    grandtotal = 0.0
-    columnNames = ['Produkt', 'Umsatz Br.', 'Anzahl']
-    dfs = pd.DataFrame(columns = columnNames)
+    if cube is None:
+        cube = salesByProductCube(df)
     iProducts = np.sort(listOfProducts)
 
-    for ePro in iProducts:
-        mask = df['Produkt']==ePro # Produkt Name
-        df_ePro = df.loc[mask].copy()
-        nTx = df_ePro['Anzahl'].sum()
-        total = df_ePro['Umsatz Br.'].sum()
-        grandtotal += total
+    dftotal = cube.groupby(level='Produkt', observed=True)[['Umsatz Br.', 'Anzahl']].sum().reindex(iProducts, fill_value=0)
+    dfs = pd.DataFrame({
+        'Produkt': iProducts,
+        'Umsatz Br.': dftotal['Umsatz Br.'].to_numpy(),
+        'Anzahl': dftotal['Anzahl'].to_numpy()
+        })
 
-        d = {}
-        d["Produkt"] = ePro
-        d["Umsatz Br."] = total
-        d["Anzahl"] = nTx
-        dfs = dfs.append(d, ignore_index=True)         #append row to the dataframe
+    grandtotal = 0.0
+    for total in dfs['Umsatz Br.']:
+        grandtotal += total
 
-    return dfs.sort_values(by=['Produkt'], ascending=True), grandtotal
+    return dfs, grandtotal
 
 def printSalesByProduct(df, total):
 
+    if isCentColumn(df['Umsatz Br.']):
+        total = total / 100
     print("\n###### Verkaufs-Statistik für ausgewählte Produkte\n")
-    print(df)
+    print(centsToEuro(df))
     print(f"\n{'Summe':>8} {total:8.2f}")
 
+# Totals and basket statistics of the Bons of a period (option --statistics),
+# computed from the receipt table. A Bon belongs to the period of its first
+# DateTime, with the interval of selectPeriods: start_date < DateTime <= end_date.
+
+def selectReceiptPeriods(receipts, periods):
+
+    times = receipts['Erster Zeitpunkt']
+    return [receipts[(times > pd.Timestamp(start_date)) & (times <= pd.Timestamp(end_date))] for start_date, end_date in periods]
+
+lBasketSizes = [1, 2, 3, 4, 5]
+
+def printReceiptStatistics(receipts):
+
+    print("\n###### Bon-Statistik\n")
+    nBons = receipts.shape[0]
+    if nBons == 0:
+        print("\tKeine Bons im Zeitraum")
+        return
+
+    amounts = centsToEuro(receipts.drop(columns=['Zeilen', 'Zeilen Dienst', 'Erster Zeitpunkt', 'Letzter Zeitpunkt']))
+    totals = receipts[amounts.columns].sum()
+    if isCentColumn(receipts['Umsatz Br.']):
+        totals = totals / 100
+    print("{:<30} {:>12d}".format('Anzahl Bons', nBons))
+    print("{:<30} {:>12d}".format('Anzahl Positionen', int(receipts['Zeilen'].sum())))
+    for name, total in totals.items():
+        print("{:<30} {:>12.2f}".format(name, total))
+
+    print("\n###### Warenkorb\n")
+    nService = receipts['Zeilen Dienst'].to_numpy()
+    nLines = receipts['Zeilen'].to_numpy()
+    print("{:<30} {:>12.2f}".format('Positionen je Bon', nLines.mean()))
+    print("{:<30} {:>12.2f}".format('Umsatz Br. je Bon', amounts['Umsatz Br.'].mean()))
+    print("{:<30} {:>12.2f}".format('Umsatz Br. je Bon (Median)', amounts['Umsatz Br.'].median()))
+    print("{:<30} {:>12d}".format('Bons nur mit Dienstleistungen', int((nService == nLines).sum())))
+    print("{:<30} {:>12d}".format('Bons nur mit Waren', int((nService == 0).sum())))
+    print("{:<30} {:>12d}".format('Bons mit beidem', int(((nService > 0) & (nService < nLines)).sum())))
+
+    sizes = np.minimum(nLines, lBasketSizes[-1])
+    counts = np.bincount(sizes, minlength=lBasketSizes[-1] + 1)[lBasketSizes]
+    labels = [str(size) for size in lBasketSizes[:-1]] + ['{} und mehr'.format(lBasketSizes[-1])]
+    print("\n{:<30} {:>12} {:>10}".format('Positionen je Bon', 'Anzahl Bons', 'Anteil'))
+    for label, count in zip(labels, counts):
+        print("{:<30} {:>12d} {:>8.1f} %".format(label, int(count), 100 * count / nBons))
+
+# Verification of the money in cents (option --money verify).
+# The float path is computed again from the same transactions: the amounts in
+# euros (cents / 100 is the float that convertColumnToFloat reads from the
+# export) and 'Umsatz' as float product of 'Einzel VK Br.' and 'Anzahl'.
+# The collective postings (per day with option --daily), the sales per day and
+# product and the product totals are computed by the functions of the float
+# path and compared as written with '%.2f'. The differences are reported.
+
+@stage('Prüfung Cent-Beträge')
+def verifyMoney(df, daily: bool = False):
+
+    print("\n###### Beträge in Cent mit float vergleichen\n")
+    if df.empty or not isCentColumn(df['Umsatz']):
+        print("\tKeine Transaktionen mit Beträgen in Cent")
+        return
+
+    dff = df.copy(deep=False)
+    for name in ['Umsatz Br.', 'Einzel VK Br.', 'MwSt']:
+        dff[name] = df[name].to_numpy() / 100
+    sign = np.where(df['Soll/Haben'].to_numpy(dtype=object) == 'H', -1, 1)
+    dff['Umsatz'] = dff['Einzel VK Br.'].to_numpy() * df['Anzahl'].to_numpy() * sign
+
+    leadKeys = [pd.Series(dayNumber(df.index), index=df.index, name='Tag')] if daily else []
+    products = topProducts + topCoupons
+    cube, floatCube = salesByProductCube(df), salesByProductCube(dff)
+    checks = [
+        ('Sammelbuchungen', groupPostings(df, leadKeys), groupPostings(dff, leadKeys), 'Betrag'),
+        ('Umsatz je Tag und Produkt', cube.reset_index(), floatCube.reset_index(), 'Umsatz Br.'),
+        ('Umsatz je Produkt', totalSalesByProduct(df, products, cube)[0], totalSalesByProduct(dff, products, floatCube)[0], 'Umsatz Br.')
+    ]
+
+    nDiffs = 0
+    for name, exact, floats, column in checks:
+        cents = exact[column].to_numpy()
+        floatText = np.char.mod('%.2f', floats[column].to_numpy(dtype=float))
+        differs = np.rint(floatText.astype(float) * 100).astype(np.int64) != cents # -0,00 is 0 cents
+        if not differs.any():
+            print("OK: {}: keine Abweichung ({} Beträge)".format(name, len(cents)))
+            continue
+        report = exact[differs].drop(columns=[column, 'Buchungskonto', 'Anzahl', 'Wochentag'], errors='ignore')
+        if 'Tag' in report.columns:
+            report['Tag'] = pd.to_datetime(report['Tag'].to_numpy(dtype=np.int64) * nsPerDay).strftime('%Y-%m-%d')
+        report['float'] = floatText[differs]
+        report['Cent'] = np.char.mod('%.2f', cents[differs] / 100)
+        report['Differenz Cent'] = np.rint(floatText[differs].astype(float) * 100).astype(np.int64) - cents[differs]
+        print("\nWARNUNG: {}: {} Beträge weichen ab\n".format(name, int(differs.sum())))
+        printBonReport(report)
+        nDiffs += int(differs.sum())
+
+    if nDiffs > 0:
+        print("\n###### WARNUNG: {} Beträge der float Berechnung weichen von den Beträgen in Cent ab\n".format(nDiffs))
+
+# Write all output files for one period (Import, Sammelbuchungen,
+# Transaktionen and statistics) and return the collective postings.
+# The files are written concurrently (see concurrentCSV).
+
+def analyzePeriod(args, dfpp, heading, printAccounts: bool = True, receipts=None):
+
+    with concurrentCSV():
+        return writePeriod(args, dfpp, heading, printAccounts, receipts)
+
+def writePeriod(args, dfpp, heading, printAccounts, receipts=None):
+
+    dfi = pd.DataFrame() #creates a new dataframe that's empty
+    dfc = pd.DataFrame() #creates a new dataframe that's empty
+
+    writeCSV(args.file, '_' + sxImportProSaldo  + heading, dfpp, csv.QUOTE_NONNUMERIC)
+
+    if printAccounts:
+        printAccountPlan()
+
+    if (args.daily):
+        print ("\n###### Sammelbuchungen für jeden Tag erzeugen:\n")
+        dfc, dfi = dailyCollectivePostings(args.text, dfpp, verbose = args.verbose)
+        if not dfc.empty:
+            dfsums = dfc.groupby(['Konto','Gegenkonto'], observed=True).agg({'Betrag': "sum"}).reset_index()
+            print(centsToEuro(dfsums))
+    else:
+        dfc, dfi = collectivePostings(args.text, heading, dfpp, verbose=True)
+
+    if args.money == 'verify':
+        verifyMoney(dfpp, args.daily)
+
+    writeCSV(args.file, '_' + sxCollectivePostings + heading, dfc, csv.QUOTE_NONNUMERIC)
+    if args.verbose:
+        writeCSV(args.file, '_' + sxTransactions + heading, dfi, csv.QUOTE_NONNUMERIC)
+
+    if args.statistics:
+        writeStatistics(args, heading, dfpp, receipts=receipts)
+
+    return dfc
+
+# Write the sales statistics for one period.
+# In streaming mode the cube and the bounds (first and last transaction)
+# are passed and dfpp is not used. The Bon statistics are printed if the
+# receipt table of the period is passed (not in streaming mode).
+
+@stage('Statistik')
+def writeStatistics(args, heading, dfpp, cube=None, bounds=None, receipts=None):
+
+    if cube is None:
+        cube = salesByProductCube(dfpp)
+    dfstat, total = totalSalesByProduct(dfpp, topProducts, cube)
+    printSalesByProduct(dfstat, total)
+    dfstat, total = totalSalesByProduct(dfpp, topCoupons, cube)
+    printSalesByProduct(dfstat, total)
+    dfstat = dailySalesByProduct(dfpp, topProducts + topCoupons, cube, bounds)
+    writeCSV(args.file, '_SalesByProduct' + heading, dfstat, csv.QUOTE_NONE)
+    if receipts is not None:
+        printReceiptStatistics(receipts)
+
+# Periods for the batch mode (option --batch).
+# Without a given period the batch covers the date range of the dataframe.
+# The first period starts at the beginning of the month (quarter) of the
+# first transaction, the last period ends at the beginning of the month (quarter)
+# after the last transaction. A given period is split at the month (quarter)
+# boundaries. Each period has the same meaning as option --period:
+# Datum > start_date 00:00:00 & Datum <= end_date 00:00:00
+
+dBatchFrequency = {
+    'monthly': 'M',
+    'quarterly': 'Q'
+}
+
+dBatchLabel = {
+    'monthly': 'monatlich',
+    'quarterly': 'quartalsweise'
+}
+
+def batchPeriods(bounds, batch, period=None):
+
+    freq = dBatchFrequency[batch]
+    if period is not None:
+        start_date, end_date = pd.Timestamp(period[0]), pd.Timestamp(period[1])
+    else:
+        oneNs = pd.Timedelta(1, unit='ns')
+        start_date = (bounds[0] - oneNs).to_period(freq).start_time
+        end_date = (bounds[1] - oneNs).to_period(freq).end_time + oneNs
+
+    boundaries = [start_date]
+    boundaries += [d for d in pd.date_range(start_date, end_date, freq=freq + 'S') if start_date < d < end_date]
+    boundaries += [end_date]
+
+    return [(s.strftime('%Y-%m-%d'), e.strftime('%Y-%m-%d')) for s, e in zip(boundaries[:-1], boundaries[1:])]
+
+# Incremental mode (option --incremental)
+# The GDPdU export of the cash register grows, new transactions are appended
+# at the end of the file. The state file <file>_Verarbeitungsstand.json next
+# to the export holds
+# - the processed byte prefix of the export (offset and sha256 checksum)
+# - the last Bon_Nummer with its first and last DateTime, the last DateTime
+# - the Bon numbers as ranges (see bonRanges) for the gap check
+# - the running totals per ('Konto', 'Gegenkonto', 'St-SL')
+# A run reads only the complete lines after the processed prefix (single-read
+# engine) and writes the output files for the new rows only, with the heading
+# _Bon_<first>_bis_<last>. The gap check covers the boundary to the processed
+# prefix. If the prefix has changed (checksum) or the state was written by
+# another program version, with other tax and account dictionaries or with
+# money in cents instead of float (option --money) or vice versa,
+# the whole export is processed again (full rebuild).
+
+stateFormatVersion = 1
+
+def stateFileName(infile):
+
+    return os.path.splitext(infile)[0] + '_' + sxState + '.json'
+
+def prefixChecksum(infile, offset):
+
+    sha = hashlib.sha256()
+    with open(infile, 'rb') as handle:
+        remaining = offset
+        while remaining > 0:
+            block = handle.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            sha.update(block)
+            remaining -= len(block)
+    return sha.hexdigest()
+
+def loadState(infile, money: str = 'float'):
+
+    path = stateFileName(infile)
+    if not os.path.exists(path):
+        print("Kein Verarbeitungsstand {} vorhanden, die CSV Datei wird vollständig verarbeitet.".format(path))
+        return None
+
+    try:
+        with open(path, 'r', encoding='utf-8') as handle:
+            state = json.load(handle)
+    except (OSError, ValueError):
+        print("WARNUNG: Der Verarbeitungsstand {} kann nicht gelesen werden: {}".format(path, sys.exc_info()[0]))
+        print("WARNUNG: Die CSV Datei wird vollständig neu verarbeitet.")
+        return None
+
+    if state.get('stateFormat') != stateFormatVersion or state.get('programVersion') != programVersion or state.get('config') != configHash():
+        print("Der Verarbeitungsstand {} wurde mit einer anderen Programmversion oder anderen Kontenrahmen erzeugt.".format(path))
+        print("Die CSV Datei wird vollständig neu verarbeitet.")
+        return None
+
+    if (state.get('money', 'float') == 'float') != (money == 'float'):
+        print("Der Verarbeitungsstand {} wurde mit einer anderen Option --money erzeugt.".format(path))
+        print("Die CSV Datei wird vollständig neu verarbeitet.")
+        return None
+
+    if os.path.getsize(infile) < state['offset'] or prefixChecksum(infile, state['offset']) != state['prefix']:
+        print("WARNUNG: Der bereits verarbeitete Teil der CSV Datei {} wurde verändert.".format(infile))
+        print("WARNUNG: Die CSV Datei wird vollständig neu verarbeitet.")
+        return None
+
+    print("Verarbeitungsstand geladen: {} Transaktionen bis Bon {} ({})".format(state['nRows'], state['lastBon'], state['lastDateTime']))
+    return state
+
+def saveState(infile, state):
+
+    path = stateFileName(infile)
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'w', encoding='utf-8') as handle:
+        json.dump(state, handle)
+    os.replace(tmpPath, path)
+    print("\nVerarbeitungsstand gespeichert: {}".format(path))
+
+# Read the complete lines after offset (at least the header line).
+# Returns the dataframe (None if there are no new lines) and the new offset.
+
+def readNewRows(infile, offset, compact: bool = False):
+
+    try:
+        with open(infile, 'rb') as handle:
+            header = handle.readline()
+            offset = max(offset, len(header))
+            handle.seek(offset)
+            data = handle.read()
+    except OSError:
+        print("Fehler beim Lesen der CSV Datei {}: {}".format(infile, sys.exc_info()[0]))
+        exit(1)
+
+    end = data.rfind(b'\n') + 1
+    if end == 0:
+        return None, offset
+
+    handle = io.TextIOWrapper(openExport(infile, io.BytesIO(header + data[:end])), encoding='latin-1', newline='')
+    da = readCSVSingle(infile, compact, handle=handle)
+    checkDstWare(da)
+    return da, offset + end
+
+def incrementalAnalysis(args):
+
+    print("\n###### Inkrementeller Modus\n")
+
+    state = loadState(args.file, args.money)
+    if state is None:
+        state = {'offset': 0, 'nRows': 0, 'lastBon': None, 'lastBonTimes': None, 'lastDateTime': None, 'bonRanges': [], 'totals': []}
+
+    da, offset = readNewRows(args.file, state['offset'], args.compact)
+    if da is None or da.empty:
+        print("\nKeine neuen Transaktionen nach Bon {} ({})".format(state['lastBon'], state['lastDateTime']))
+        return
+
+    dfp = preprocessDataframe(da, checkBons=False, money=args.money)
+    del da
+
+# Bon check across the boundary to the processed prefix
+
+    receipts = receiptTable(dfp)
+    bons = receipts.index.to_numpy()
+    ranges = mergeBonRanges(np.array(state['bonRanges'], dtype=np.int64).reshape(-1, 2), bonRanges(bons))
+    times = receipts[['Erster Zeitpunkt', 'Letzter Zeitpunkt']]
+    lastTimes = None
+    if state['lastBon'] is not None:
+        lastTimes = pd.DataFrame({'Erster Zeitpunkt': pd.to_datetime([state['lastBonTimes'][0]]),
+            'Letzter Zeitpunkt': pd.to_datetime([state['lastBonTimes'][1]])}, index=pd.Index([state['lastBon']], name='Bon_Nummer'))
+    reportBonRanges(ranges, multipleBonTimes(mergeBonTimes(lastTimes, times)), args.file if args.bon_report else None)
+
+    heading = '_Bon_{}_bis_{}'.format(bons.min(), bons.max())
+    print ("\n###### Neue Transaktionen von Bon {} bis Bon {} ".format(bons.min(), bons.max()))
+    analyzePeriod(args, dfp, heading, receipts=receipts)
+
+# running totals since the beginning of the export
+
+    totalKeys = ['Konto', 'Gegenkonto', 'St-SL']
+    sums = dfp.groupby(totalKeys, observed=True)['Umsatz'].sum().rename('Betrag').reset_index().astype({key: object for key in totalKeys})
+    totals = pd.concat([pd.DataFrame(state['totals'], columns=totalKeys + ['Betrag']), sums], ignore_index=True)
+    totals = totals.groupby(totalKeys, sort=True)['Betrag'].sum().astype(sums['Betrag'].dtype).reset_index()
+    print("\n###### Summen seit Beginn der CSV Datei\n")
+    print(centsToEuro(totals))
+
+    lastTimes = mergeBonTimes(lastTimes, times).iloc[-1:]
+    dates = dfp.index.dropna()
+    lastDateTime = dates[-1] if state['lastDateTime'] is None else max(dates[-1], pd.Timestamp(state['lastDateTime']))
+
+    saveState(args.file, {
+        'stateFormat': stateFormatVersion,
+        'programVersion': programVersion,
+        'config': configHash(),
+        'money': args.money,
+        'offset': offset,
+        'prefix': prefixChecksum(args.file, offset),
+        'nRows': state['nRows'] + dfp.shape[0],
+        'lastBon': int(lastTimes.index[0]),
+        'lastBonTimes': [str(lastTimes.iat[0, 0]), str(lastTimes.iat[0, 1])],
+        'lastDateTime': str(lastDateTime),
+        'bonRanges': ranges.tolist(),
+        'totals': totals.values.tolist()
+    })
+
+# Streaming mode (option --chunksize)
+# The export is read in chunks of chunksize rows. Each chunk is preprocessed
+# and passed to one PeriodAggregator per output period. An aggregator appends
+# the transactions to the _Import_ file and keeps only running sums:
+# the collective postings per ('Soll/Haben', 'Konto', 'Gegenkonto', 'St-SL')
+# (per day with option --daily), the statistics cube, the first and the last
+# transaction. The Bon numbers are kept as ranges (see bonRanges), so gaps
+# are detected across chunk boundaries. Bons with more than one DateTime are
+# detected within a chunk and between neighbouring chunks.
+# Peak memory depends on the chunk size and the number of groups,
+# not on the length of the export.
+# Differences to the normal mode:
+# - the _Import_ file is sorted by DateTime within each chunk only (stable,
+#   see sortOrder), this is the same order as in normal mode for an export in
+#   chronological order
+# - the file with all transactions (option --verbose) is not written
+
+def combineSums(running, partial, func="sum"):
+
+    if running is None:
+        return partial
+    if partial.empty:
+        return running
+    return pd.concat([running, partial]).groupby(level=list(range(partial.index.nlevels)), sort=False, observed=True).agg(func)
+
+class PeriodAggregator:
+
+    def __init__(self, args, heading):
+        self.args = args
+        self.heading = heading
+        self.outfile = outputFileName(args.file, '_' + sxImportProSaldo + heading)
+        self.handle = None
+        self.template = None
+        self.first = None
+        self.last = None
+        self.nTx = 0
+        self.nH = 0
+        self.postings = None
+        self.dayFirst = None
+        self.dayCount = None
+        self.dayH = None
+        self.cube = None
+        self.nUndated = 0
+
+    def add(self, df):
+
+        if self.template is None:
+            self.template = df.iloc[:0]
+        if df.empty:
+            return
+
+        if self.handle is None:
+            self.handle = open(self.outfile, 'w', encoding='latin-1', newline='')
+            appendCSV(self.handle, df, csv.QUOTE_NONNUMERIC, header=True)
+        else:
+            appendCSV(self.handle, df, csv.QUOTE_NONNUMERIC, header=False)
+
+        self.first, self.last = widenBounds((self.first, self.last), df.index)
+        self.nTx += df.shape[0]
+        isH = (df['Soll/Haben'] == 'H').to_numpy()
+        self.nH += int(isH.sum())
+
+        if self.args.daily or self.args.statistics:
+            dated = df.index.notna()
+            if not dated.all():
+                df, isH = df[dated], isH[dated]
+                self.nUndated += int((~dated).sum())
+        tag = pd.Series(dayNumber(df.index), index=df.index, name='Tag')
+        if self.args.daily:
+            self.postings = combineSums(self.postings, df.groupby([tag] + cpKeys, sort=False, observed=True)['Umsatz'].sum())
+            self.dayFirst = combineSums(self.dayFirst, pd.Series(df.index, index=tag.to_numpy()).groupby(level=0).min(), "min")
+            self.dayCount = combineSums(self.dayCount, tag.value_counts())
+            self.dayH = combineSums(self.dayH, tag[isH].value_counts())
+        else:
+            self.postings = combineSums(self.postings, df.groupby(cpKeys, sort=False, observed=True)['Umsatz'].sum())
+        if self.args.statistics:
+            self.cube = combineSums(self.cube, df.groupby([tag, 'Produkt'], sort=True, observed=True)[['Umsatz Br.', 'Anzahl']].sum())
+
+    def finish(self, printAccounts: bool = True):
+
+        args = self.args
+        heading = self.heading
+
+        if self.handle is None:
+            writeCSV(args.file, '_' + sxImportProSaldo + heading, self.template, csv.QUOTE_NONNUMERIC)
+        else:
+            self.handle.close()
+            print("\nDataframe als CSV Datei gespeichert: {}".format(self.outfile))
+
+        if printAccounts:
+            printAccountPlan()
+
+        dfc = pd.DataFrame() #creates a new dataframe that's empty
+        if self.nUndated > 0:
+            print("\n\tWARNUNG: {} Transaktionen ohne gültiges Datum sind in den täglichen Sammelbuchungen und der Statistik nicht enthalten".format(self.nUndated))
+        if args.daily:
+            print ("\n###### Sammelbuchungen für jeden Tag erzeugen:\n")
+            if self.first is None:
+                print("\tKeine Transaktionen mit Datum im Zeitraum\n")
+            else:
+                start_date, end_date = dayRange(self.first, self.last)
+                dfcp = sortPostings(self.postings.rename('Betrag').reset_index(), ['Tag'])
+                dfc = formatDailyPostings(args.text, dfcp, self.dayFirst, self.dayCount, self.dayH, start_date, end_date, verbose = args.verbose)
+            if not dfc.empty:
+                dfsums = dfc.groupby(['Konto','Gegenkonto'], observed=True).agg({'Betrag': "sum"}).reset_index()
+                print(centsToEuro(dfsums))
+        elif self.nTx > 0:
+            dfcp = sortPostings(self.postings.rename('Betrag').reset_index())
+            dfc = formatCollectivePostings(args.text, heading, dfcp, self.first, self.nH, self.nTx, verbose=True)
+
+        writeCSV(args.file, '_' + sxCollectivePostings + heading, dfc, csv.QUOTE_NONNUMERIC)
+
+        if args.statistics:
+            if self.nTx == 0:
+                writeStatistics(args, heading, self.template)
+            else:
+                writeStatistics(args, heading, None, addWeekday(self.cube), (self.first, self.last))
+
+        return dfc
+
+# Periods of the rows of one chunk for option --batch: (start_date, end_date, heading)
+
+def chunkBatchPeriods(df, batch, period=None):
+
+    freq = dBatchFrequency[batch]
+    oneNs = pd.Timedelta(1, unit='ns')
+    result = []
+    for p in (df.index.dropna() - oneNs).to_period(freq).unique():
+        start_date, end_date = p.start_time, p.end_time + oneNs
+        if period is not None:
+            start_date = max(start_date, pd.Timestamp(period[0]))
+            end_date = min(end_date, pd.Timestamp(period[1]))
+        if start_date < end_date:
+            start_date, end_date = start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+            result.append((start_date, end_date, '_vom_' + start_date + '_bis_' + end_date))
+    return result
+
+def streamDataframe(args):
+
+    print ("\n###### Streaming Modus: Die CSV Datei wird in Blöcken zu {} Zeilen verarbeitet\n".format(args.chunksize))
+    if args.verbose:
+        print("WARNUNG: Im Streaming Modus wird keine CSV Datei mit allen Transaktionen geschrieben.")
+    if args.money == 'verify':
+        print("WARNUNG: Im Streaming Modus werden nur die eingelesenen Beträge mit float verglichen, nicht die Summen.")
+
+    fixedPeriods = None
+    if args.periods is not None:
+        fixedPeriods = [(start_date, end_date, '_vom_' + start_date + '_bis_' + end_date) for start_date, end_date in args.periods]
+    elif args.batch is None:
+        if args.period is None:
+            fixedPeriods = [(None, None, '_All')]
+        else:
+            start_date, end_date = args.period
+            fixedPeriods = [(start_date, end_date, '_vom_' + start_date + '_bis_' + end_date)]
+
+    aggregators = {}
+    if fixedPeriods is not None:
+        for start_date, end_date, heading in fixedPeriods:
+            aggregators[heading] = PeriodAggregator(args, heading)
+
+    ranges = np.empty((0, 2), dtype=np.int64)
+    multiple = lastTimes = None
+    warnings = set()
+    first = last = None
+    nRows = 0
+
+    chunks = iter(readCSVChunks(args.file, args.chunksize, args.compact, args.engine))
+    for nChunk in itertools.count():
+        with stage('CSV Daten lesen'):
+            chunk = next(chunks, None)
+            stageRows(rowsOut=countRows(chunk))
+        if chunk is None:
+            break
+        checkDstWare(chunk)
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            dfp = preprocessDataframe(chunk, checkBons=False, money=args.money)
+        for line in output.getvalue().splitlines():
+            if 'WARNUNG' in line and line not in warnings:
+                print(line)
+                warnings.add(line)
+
+        nRows += dfp.shape[0]
+        first, last = widenBounds((first, last), dfp.index)
+        bons = dfp['Bon_Nummer'].to_numpy()
+        ranges = mergeBonRanges(ranges, bonRanges(bons))
+        times = bonTimes(bons, dfp['DateTime'].to_numpy())
+        multiple = mergeBonTimes(multiple, multipleBonTimes(mergeBonTimes(lastTimes, times)))
+        lastTimes = times
+
+        periods = fixedPeriods if fixedPeriods is not None else chunkBatchPeriods(dfp, args.batch, args.period)
+        selected = selectPeriods(dfp, [(start_date, end_date) for start_date, end_date, heading in periods if start_date is not None])
+        for start_date, end_date, heading in periods:
+            if heading not in aggregators:
+                aggregators[heading] = PeriodAggregator(args, heading)
+            if start_date is None:
+                aggregators[heading].add(dfp)
+            else:
+                aggregators[heading].add(selected.pop(0))
+            if aggregators[heading].template is None:
+                aggregators[heading].template = dfp.iloc[:0]
+
+        print("Block {}: {} Transaktionen verarbeitet".format(nChunk + 1, nRows), end='\r')
+
+    print("\n\nGesamt Anz. Transaktionen\t {:>8d}".format(nRows))
+    if nRows == 0:
+        print("Die CSV Datei {} enthält keine Transaktionen.".format(args.file))
+        exit(1)
+    print(f"Startdate: {first}")
+    print(f"Enddate:   {last}")
+
+    reportBonRanges(ranges, multiple, args.file if args.bon_report else None)
+
+    if fixedPeriods is None:
+        template = next(iter(aggregators.values())).template
+        fixedPeriods = []
+        for start_date, end_date in batchPeriods((first, last), args.batch, args.period):
+            heading = '_vom_' + start_date + '_bis_' + end_date
+            if heading not in aggregators:
+                aggregators[heading] = PeriodAggregator(args, heading)
+                aggregators[heading].template = template
+            fixedPeriods.append((start_date, end_date, heading))
+
+    dfcp = []
+    for n, (start_date, end_date, heading) in enumerate(fixedPeriods):
+        if start_date is not None:
+            print ("\n###### Periode vom {} bis {} ".format(start_date, end_date))
+        dfcp.append(aggregators[heading].finish(printAccounts=(n == 0)))
+
+    return fixedPeriods, dfcp
+
+# Write the collective postings of all periods of the batch mode into one file
+
+def writeBatchPostings(args, periods, dfcp):
+
+    label = 'Perioden' if args.periods is not None else dBatchLabel[args.batch]
+    years = sorted(set(start_date[:4] for start_date, end_date in periods))
+    label = '-'.join([years[0], years[-1]] if len(years) > 1 else years) + '_' + label
+
+    print ("\n###### Sammelbuchungen aller {} Perioden zusammenfassen\n".format(len(periods)))
+    writeCSV(args.file, '_' + sxCollectivePostings + '_' + label, pd.concat(dfcp, ignore_index=True), csv.QUOTE_NONNUMERIC)
+
+# Analyze the preprocessed dataframe: one period (option --period or all
+# transactions) or several periods (options --batch and --periods).
+# receipts is the receipt table of dfp (see receiptTable).
+# Returns the collective postings of all periods.
+
+def analyzeDataframe(args, dfp, receipts=None):
+
+    if (args.batch is not None) or (args.periods is not None):
+        print ("\n###### Analyse für mehrere Perioden:\n")
+        if args.periods is not None:
+            periods = [tuple(period) for period in args.periods]
+        else:
+            dates = dfp.index.dropna() # NaT (unknown date) is sorted last
+            periods = batchPeriods((dates[0], dates[-1]), args.batch, args.period)
+
+        periodReceipts = selectReceiptPeriods(receipts, periods) if receipts is not None else [None] * len(periods)
+        dfcp = []
+        for n, ((start_date, end_date), dfpp) in enumerate(zip(periods, selectPeriods(dfp, periods))):
+            print ("\n###### Periode vom {} bis {} ".format(start_date, end_date))
+            heading = '_vom_' + start_date + '_bis_' + end_date
+            dfcp.append(analyzePeriod(args, dfpp, heading, printAccounts=(n == 0), receipts=periodReceipts[n]))
+
+        writeBatchPostings(args, periods, dfcp)
+    else:
+        if (args.period is None):
+            dfpp = dfp
+            heading = '_All'
+        else:
+            print ("\n###### Analyse mit Filtern:\n")
+            start_date, end_date = args.period
+            heading = '_vom_' + start_date + '_bis_' + end_date
+            print ("Periode vom {} bis {} ".format(start_date, end_date))
+            dfpp = selectReceiptDate(dfp, start_date, end_date)
+            if receipts is not None:
+                receipts = selectReceiptPeriods(receipts, [args.period])[0]
+
+        dfcp = [analyzePeriod(args, dfpp, heading, receipts=receipts)]
+
+    return dfcp
+
+# Several exports (option --files, e.g. one export per cash register and site).
+# The exports are read and preprocessed in parallel by a pool of worker
+# processes (option --workers). A worker returns the preprocessed dataframe
+# and the receipt table encoded as numpy arrays (see encodeDataframe) and its
+# console output.
+# The results are analyzed in the order of the input files, whatever order
+# the workers finish in: each export gets its own output files, and the
+# collective postings of all exports are merged per (period, 'Konto',
+# 'Gegenkonto', 'St-SL') into the file GDPdU_Sammelbuchungen_konsolidiert.
+# The period is part of the posting text 'Text', the date 'Datum' of a merged
+# posting is the earliest date of the exports.
+
+# Names of the output files <stem>_<suffix>_<heading>.csv (see writePeriod,
+# writeBatchPostings, incrementalAnalysis and analyzeFiles) and
+# <stem>_BonPruefung.csv, <stem>_Reparatur.csv. Only files with exactly these
+# names are skipped in a directory, the skipped files are listed.
+
+lPeriodOutputs = [sxImportProSaldo, sxCollectivePostings, sxTransactions, 'SalesByProduct']
+
+sxPeriodHeading = r'(All|vom_\d{4}-\d{2}-\d{2}_bis_\d{4}-\d{2}-\d{2}|Bon_-?\d+_bis_-?\d+)'
+sxBatchHeading = r'(\d{4}(-\d{4})?_(' + '|'.join(list(dBatchLabel.values()) + ['Perioden']) + ')|konsolidiert)'
+
+reOutputFile = re.compile(r'.+_(' +
+    '(' + '|'.join(lPeriodOutputs) + ')_' + sxPeriodHeading + '|' +
+    sxCollectivePostings + '_' + sxBatchHeading + '|' +
+    '(' + sxBonReport + '|' + sxRepairLog + ')' +
+    r')(?i:\.csv)')
+
+def isOutputFile(name):
+
+    return reOutputFile.fullmatch(name) is not None
+
+def exportFiles(paths, verbose: bool = True):
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if not name.lower().endswith('.csv'):
+                    continue
+                if isOutputFile(name):
+                    if verbose:
+                        print("Ausgabedatei wird übersprungen: {}".format(os.path.join(path, name)))
+                else:
+                    files.append(os.path.join(path, name))
+        else:
+            files.append(path)
+    return files
+
+def fileArguments(args, infile):
+
+    return argparse.Namespace(**dict(vars(args), file=infile))
+
+def preprocessWorker(args, infile):
+
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            selectTaxRules(args.rules)
+            dfp, receipts = readEnrichedDataframe(fileArguments(args, infile))
+    except SystemExit:
+        return output.getvalue(), None
+    return output.getvalue(), (encodeDataframe(dfp), encodeDataframe(receipts))
+
+def analyzeFiles(args):
+
+    files = exportFiles(args.files)
+    if not files:
+        print("Keine CSV Dateien gefunden: {}".format(args.files))
+        exit(1)
+    print ("\n###### Analyse von {} GDPdU Exporten mit {} Prozessen\n".format(len(files), args.workers))
+
+    dfcp = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for infile, (output, encoded) in zip(files, executor.map(preprocessWorker, itertools.repeat(args), files)):
+            print ("\n###### GDPdU Export {}\n".format(infile))
+            print(output, end='')
+            if encoded is None:
+                print("WARNUNG: Die CSV Datei {} wird übersprungen.".format(infile))
+                continue
+            dfcp.extend(analyzeDataframe(fileArguments(args, infile), *[decodeDataframe(*table) for table in encoded]))
+
+    outdir = args.files[0] if os.path.isdir(args.files[0]) else os.path.dirname(files[0])
+    writeConsolidatedPostings(os.path.join(outdir, 'GDPdU.csv'), dfcp)
+
+def writeConsolidatedPostings(infile, dfcp):
+
+    print ("\n###### Sammelbuchungen aller GDPdU Exporte zusammenfassen\n")
+    columns = ['Konto', 'Gegenkonto', 'St-SL', 'Betrag', 'Datum', 'Text']
+    dfcp = [dfc for dfc in dfcp if not dfc.empty]
+    if not dfcp:
+        dfk = pd.DataFrame(columns=columns)
+    else:
+        dfc = pd.concat(dfcp, ignore_index=True)
+        dfc['Datum'] = pd.to_datetime(dfc['Datum'], format='%d.%m.%Y')
+        dfk = dfc.groupby(['Text', 'Konto', 'Gegenkonto', 'St-SL'], sort=True, observed=True).agg(
+            Betrag=('Betrag', 'sum'), Datum=('Datum', 'min')).reset_index()
+        dfk['Datum'] = dfk['Datum'].dt.strftime('%d.%m.%Y')
+        dfk = dfk[columns]
+    writeCSV(infile, '_' + sxCollectivePostings + '_konsolidiert', dfk, csv.QUOTE_NONNUMERIC)
+
 # Main function using argparse for commandline arguments and options
 # Die Nummer des Wertgutscheins steht in Spalte "Beleginfo - Inhalt 6"
 # Dies gilt sowohl bei Verkauf eines Gutscheins als auch bei Einlösung
 # Beim Verkauf des Warengutscheins enthält die Spalte "Buchungstext"
 # den Inhalt "Verkauf Warengutschein", Bei Einlösung "Verkauf"
 
-def main():
-    print("\n###### This is {} Version {} last modified {} ######".format(os.path.basename(sys.argv[0]), programVersion, lastModified))
-    print("\nPython version is {}".format(sys.version))
-
-    parser = argparse.ArgumentParser(description='Salden per Konto aus dem GDPdU Export von KI-Kasse')
-    parser.add_argument('-f','--file', help='Name der CSV Datei mit dem KI-Kasse GDPdU export', required=True)
+def argumentParser():
+
+    parser = argparse.ArgumentParser(description='Salden per Konto aus dem GDPdU Export von KI-Kasse',
+        epilog='Spaltenspeicher erstellen: %(prog)s convert -f FILE [-o STORE] (siehe %(prog)s convert -h)')
+    files = parser.add_mutually_exclusive_group(required=True)
+    files.add_argument('-a','--accounts', help='Nur die Kontenrahmen für Sammelbuchungen ausgeben (ohne CSV Datei).',
+        action='store_true', default=False)
+    files.add_argument('-J','--jobs', metavar='JOBFILE',
+        help="Mehrere Aufträge in einem Prozess ausführen, eine Zeile je Auftrag mit den Optionen eines Aufrufs (z.B. -f FILE -p start_date end_date -t TEXT), '-' liest die Aufträge von stdin.")
+    files.add_argument('-S','--serve', metavar='PORT', type=int,
+        help='Server Modus: vorverarbeitete Exporte im Speicher halten und Aufträge (Optionen wie bei --jobs) per HTTP POST auf 127.0.0.1:PORT ausführen.')
+    files.add_argument('-f','--file', help='Name der CSV Datei mit dem KI-Kasse GDPdU export oder eines Spaltenspeichers (siehe convert -h)')
+    files.add_argument('-F','--files', nargs='+', metavar='FILE',
+        help='Mehrere CSV Dateien oder Verzeichnisse mit GDPdU Exporten parallel verarbeiten, die Sammelbuchungen werden zusätzlich in einer Datei zusammengefasst.')
     parser.add_argument(
         '-p','--period',
         nargs=2,
@@ -759,78 +3208,503 @@ def main():
         required=False, action='store_true', default=False)
     parser.add_argument('-s','--statistics', help='Analyse für ausgewählte Produkte erzeugen.',
         required=False, action='store_true', default=False)
+    parser.add_argument('-b','--batch', help='Analyse für jeden Monat (Quartal) im Zeitraum (--period) oder in der CSV Datei. Die Sammelbuchungen werden zusätzlich in einer Datei zusammengefasst.',
+        required=False, choices=list(dBatchFrequency.keys()))
+    parser.add_argument(
+        '-P','--periods',
+        nargs=2,
+        action='append',
+        metavar=('start_date', 'end_date'),
+        help='Analyse für mehrere Perioden, kann mehrfach angegeben werden (Format: YYYY-MM-DD YYYY-MM-DD)',
+        required=False)
+    parser.add_argument('-w','--workers', help='Anzahl der Prozesse für --files (Default: Anzahl der CPUs)',
+        required=False, type=int, default=os.cpu_count())
+    parser.add_argument('--chunksize', help='Streaming Modus: CSV Datei in Blöcken mit CHUNKSIZE Zeilen verarbeiten (begrenzter Speicherbedarf).',
+        required=False, type=int)
+    parser.add_argument('-i','--incremental', help='Inkrementeller Modus: nur die seit dem letzten Lauf neuen Zeilen der CSV Datei verarbeiten (Verarbeitungsstand in <FILE>_Verarbeitungsstand.json).',
+        required=False, action='store_true', default=False)
+    parser.add_argument('--engine', help='Verfahren zum Einlesen der CSV Datei: classic (Default) oder single (nur ein Lesedurchgang, Zahlen werden direkt konvertiert).',
+        required=False, choices=['classic', 'single'], default='classic')
+    parser.add_argument('--money', help='Beträge als float (Default) oder exakt in Cent (int64) rechnen, verify rechnet in Cent und meldet Abweichungen zur Rechnung mit float.',
+        required=False, choices=lMoneyModes, default='float')
+    parser.add_argument('--rules', metavar='FILE', help='Regeldatei (CSV) mit Gültigkeitszeiträumen für Steuerschlüssel und Erlöskonten statt der eingebauten Tabellen.',
+        required=False)
+    parser.add_argument('--compact', help='Textspalten als Kategorien speichern (geringerer Speicherbedarf).',
+        required=False, action='store_true', default=False)
+    parser.add_argument('--bon-report', help='Fehlende Bon Nummern und Bons mit mehreren Zeitpunkten in die CSV Datei <FILE>_BonPruefung schreiben.',
+        required=False, action='store_true', default=False)
+    parser.add_argument('--memory', help='Speicherbedarf (tracemalloc Spitze und max. RSS) je Verarbeitungsschritt ausgeben.',
+        required=False, action='store_true', default=False)
+    parser.add_argument('--profile', help='Laufzeit, Anzahl Zeilen und max. RSS je Verarbeitungsschritt ausgeben (mit --memory auch tracemalloc Spitze).',
+        required=False, action='store_true', default=False)
+    parser.add_argument('--profile-json', metavar='FILE', help='Jeden Verarbeitungsschritt als JSON Zeile in die Datei FILE schreiben.',
+        required=False)
+    parser.add_argument('--profile-dump', metavar='FILE', help='cProfile Statistik in die Datei FILE schreiben (z.B. für pstats oder snakeviz).',
+        required=False)
+    parser.add_argument('--watch', metavar='DIR', help='Server Modus: Exporte im Verzeichnis DIR laden und bei Änderungen neu laden.',
+        required=False)
+    parser.add_argument('--datasets', help='Server Modus: Anzahl Exporte im Speicher (Default: {})'.format(defDatasets),
+        required=False, type=int, default=defDatasets)
+    parser.add_argument('-c','--cache', help='Vorverarbeitete Daten im Cache speichern bzw. aus dem Cache laden.',
+        required=False, action='store_true', default=False)
+    parser.add_argument('--cache-dir', help='Verzeichnis für den Cache (Default: {})'.format(defCacheDir),
+        required=False, default=defCacheDir)
+    parser.add_argument('--cache-size', help='Maximale Größe des Cache in MB (Default: {})'.format(defCacheSizeMB),
+        required=False, type=int, default=defCacheSizeMB)
+
+    return parser
+
+# Command convert: GDPdU export to columnar store (see writeColumnStore)
 
+def convertParser():
+
+    parser = argparse.ArgumentParser(prog='{} convert'.format(os.path.basename(sys.argv[0])),
+        description='GDPdU Export von KI-Kasse vorverarbeiten und als Spaltenspeicher speichern, der mit -f STORE ohne Einlesen der CSV Datei analysiert wird.')
+    parser.add_argument('-f','--file', help='Name der CSV Datei mit dem KI-Kasse GDPdU export', required=True)
+    parser.add_argument('-o','--output', metavar='STORE', help='Verzeichnis des Spaltenspeichers (Default: <FILE>_{})'.format(sxColumnStore),
+        required=False)
+    parser.add_argument('--engine', help='Verfahren zum Einlesen der CSV Datei: classic (Default) oder single.',
+        required=False, choices=['classic', 'single'], default='classic')
+    parser.add_argument('--money', help='Beträge als float (Default) oder exakt in Cent (int64) speichern.',
+        required=False, choices=['float', 'cents'], default='float')
+    parser.add_argument('--rules', metavar='FILE', help='Regeldatei (CSV) mit Gültigkeitszeiträumen für Steuerschlüssel und Erlöskonten.',
+        required=False)
+
+    return parser
+
+# Main function using argparse for commandline arguments and options
 
+def main():
+    print("\n###### This is {} Version {} last modified {} ######".format(os.path.basename(sys.argv[0]), programVersion, lastModified))
+    print("\nPython version is {}".format(sys.version))
+
+    if sys.argv[1:2] == ['convert']:
+        args = convertParser().parse_args(sys.argv[2:])
+        selectTaxRules(args.rules)
+        convertExport(args)
+        print("\n###### Programm wurde normal beendet.\n")
+        return
+
+    parser = argumentParser()
     args = parser.parse_args()
 
-    df = readCSV(args.file)
+    if args.accounts:
+        selectTaxRules(args.rules)
+        printAccountPlan()
+    elif args.jobs is not None:
+        runJobs(parser, args)
+    elif args.serve is not None:
+        serve(parser, args)
+    else:
+        runJob(args)
 
-    dfi = pd.DataFrame() #creates a new dataframe that's empty
-    dfc = pd.DataFrame() #creates a new dataframe that's empty
+    print("\n###### Programm wurde normal beendet.\n")
+
+# Run one job (a single run or a job of option --jobs)
+
+def runJob(args):
 
-    if (args.period is None):
-        dfpp = preprocessDataframe(df)
-        heading = '_All'
+    if args.memory or args.profile or (args.profile_json is not None):
+        startStages(memory=args.memory, jsonFile=args.profile_json)
+
+    checkPeriods([args.period] if args.period is not None else [])
+    checkPeriods(args.periods if args.periods is not None else [])
+    selectTaxRules(args.rules)
+
+    if args.profile_dump is not None:
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(analyze, args)
+        finally:
+            profiler.dump_stats(args.profile_dump)
+            print("\ncProfile Statistik gespeichert: {}".format(args.profile_dump))
     else:
-        print ("\n###### Analyse mit Filtern:\n")
-        start_date, end_date = args.period
-        heading = '_vom_' + start_date + '_bis_' + end_date
-        print ("Periode vom {} bis {} ".format(start_date, end_date))
-        dfp = preprocessDataframe(df)
-        dfpp = selectReceiptDate(dfp, start_date, end_date)
+        analyze(args)
+
+    printStages()
+
+# Warm mode (option --jobs): several jobs in one process, so pandas and numpy
+# are imported only once. The job file has one job per line with the options
+# of a single run, e.g.
+#     -f GDPdU.csv -p 2018-01-01 2018-02-01 -t Januar
+# The options given together with --jobs are the defaults of every job.
+# Empty lines and lines starting with '#' are skipped. With '-' the jobs are
+# read from stdin one at a time, so the process can be kept running and fed
+# through a pipe. A job that fails is reported and the next job is run.
+# The preprocessed dataframe of the last export is kept in memory and used
+# again by the next job for the same export (see readEnrichedDataframe).
+
+def runJobs(parser, args):
+
+    defaults = dict(vars(args), jobs=None)
+    dWarmData['enabled'] = True
+    handle = sys.stdin if args.jobs == '-' else open(args.jobs, encoding='utf-8')
+    try:
+        n = 0
+        for line in handle:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            n += 1
+            print("\n###### Auftrag {}: {}\n".format(n, line))
+            try:
+                jobArgs = parser.parse_args(shlex.split(line), namespace=argparse.Namespace(**defaults))
+                if jobArgs.jobs is not None:
+                    parser.error('die Option --jobs ist in einem Auftrag nicht erlaubt')
+                if jobArgs.accounts:
+                    selectTaxRules(jobArgs.rules)
+                    printAccountPlan()
+                else:
+                    runJob(jobArgs)
+                print("\n###### Auftrag {} beendet\n".format(n))
+            except SystemExit:
+                print("\n###### Auftrag {} fehlgeschlagen\n".format(n))
+            except Exception as e:
+                print("\n###### Auftrag {} fehlgeschlagen: {}\n".format(n, e))
+            sys.stdout.flush()
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+# Server mode (option --serve PORT): a long-running process on localhost that
+# keeps preprocessed exports in memory and answers analysis requests over HTTP.
+# A request is a POST with a job line in the body, the same options as in a
+# job file (option --jobs), e.g.
+#     curl --data-binary '-f GDPdU.csv -p 2018-01-01 2018-02-01 -s' http://127.0.0.1:8765/
+# The output files are written as usual, the console output of the job is the
+# response (status 200, 400 for wrong options, 500 for errors). GET /status
+# lists the datasets in memory.
+# The options given together with --serve are the defaults of every request.
+# Up to --datasets preprocessed exports (dataframe and receipt table) are kept,
+# the least recently used one is dropped first (see DatasetCache). Requests for
+# the same export share one load: the first request loads, the others wait for
+# its result. A changed export is loaded again on the next request, rows
+# appended to the export are read and preprocessed incrementally, with the
+# same order of the rows as after a full load (see sortOrder).
+# With --watch DIR the exports in DIR are loaded when they appear (while
+# there is room) and reloaded when they change, every watchInterval seconds.
+# Loads run in parallel; the analyses share the CSV writer state and run one
+# at a time. Stage accounting (--profile, --memory) is not available.
+
+watchInterval = 2.0
+defDatasets = 4
+
+# Console output per thread: the output of a request goes to its response,
+# the output of other threads to the console of the server.
+
+class ThreadOutput(io.TextIOBase):
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    @contextmanager
+    def capture(self, buffer):
+        previous = getattr(self.local, 'buffer', None)
+        self.local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self.local.buffer = previous
+
+def fileSignature(infile):
+
+    stat = os.stat(infile)
+    return (stat.st_size, stat.st_mtime_ns)
+
+# The preprocessed exports in memory, by file and options --compact and --money.
+# An entry holds a future with the dataframe and the receipt table, the
+# signature (size, modification time) of the loaded file, and the offset and
+# checksum of the loaded bytes for incremental reloads (see prefixChecksum).
+
+class DatasetCache:
+
+    def __init__(self, maxDatasets, defaults):
+        self.maxDatasets = maxDatasets
+        self.defaults = defaults
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+
+    def key(self, args):
+        return (os.path.abspath(args.file), args.compact, args.money)
+
+    def get(self, args):
+
+        key = self.key(args)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = {'args': args, 'future': None, 'signature': None, 'offset': 0, 'prefix': None}
+                self.entries[key] = entry
+            self.entries.move_to_end(key)
+            future = self.startLoad(entry)
+            self.evict()
+        if future is not None:
+            self.load(key, entry, future)
+        return entry['future'].result()
+
+# start a (re)load if the entry is new or the file has changed and no load
+# is running; returns the future to be filled by the caller or None
+
+    def startLoad(self, entry):
+
+        signature = fileSignature(entry['args'].file)
+        previous = entry['future']
+        if previous is not None and (not previous.done() or entry['signature'] == signature):
+            return None
+        entry['previous'], entry['future'], entry['signature'] = previous, concurrent.futures.Future(), signature
+        return entry['future']
+
+    def load(self, key, entry, future):
+
+        args = entry['args']
+        try:
+            previous = entry.pop('previous')
+            result = None
+            if previous is not None and previous.exception() is None:
+                result = self.reload(entry, previous.result())
+            if result is None:
+                result = loadEnrichedDataframe(args)
+                size = entry['signature'][0]
+                complete = size > 0 and fileSignature(args.file) == entry['signature'] and lastByte(args.file, size) == b'\n'
+                entry['offset'], entry['prefix'] = size, prefixChecksum(args.file, size) if complete else None
+            future.set_result(result)
+        except BaseException as e:
+            future.set_exception(e)
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+
+# incremental reload: only rows appended to the loaded bytes are read,
+# None if the loaded part of the file has changed (full reload)
+
+    def reload(self, entry, result):
+
+        args = entry['args']
+        offset = entry['offset']
+        if entry['prefix'] is None or entry['signature'][0] < offset or prefixChecksum(args.file, offset) != entry['prefix']:
+            return None
+        dfp, receipts = result
+        da, newOffset = readNewRows(args.file, offset, args.compact)
+        if da is None or da.empty:
+            return result
+        print("\n###### Neue Transaktionen in {}: {}".format(args.file, da.shape[0]))
+        dfp = appendTransactions(dfp, preprocessDataframe(da, checkBons=False, money=args.money))
+        entry['offset'], entry['prefix'] = newOffset, prefixChecksum(args.file, newOffset)
+        return dfp, receiptTable(dfp)
+
+    def evict(self):
+
+        for key in list(self.entries):
+            if len(self.entries) <= self.maxDatasets:
+                break
+            if self.entries[key]['future'].done():
+                del self.entries[key]
+
+    def refresh(self, directory):
+
+        started = []
+        with self.lock:
+            loaded = {key[0] for key in self.entries}
+            for infile in exportFiles([directory], verbose=False):
+                path = os.path.abspath(infile)
+                if path not in loaded and len(self.entries) < self.maxDatasets:
+                    args = fileArguments(self.defaults, infile)
+                    entry = {'args': args, 'future': None, 'signature': None, 'offset': 0, 'prefix': None}
+                    self.entries[self.key(args)] = entry
+            for key, entry in self.entries.items():
+                if os.path.dirname(key[0]) == os.path.abspath(directory) and os.path.isfile(key[0]):
+                    future = self.startLoad(entry)
+                    if future is not None:
+                        started.append((key, entry, future))
+        for key, entry, future in started:
+            start = time.time()
+            with dServer['output'].capture(io.StringIO()):
+                self.load(key, entry, future)
+            if future.exception() is None:
+                print("Export geladen: {} ({} Transaktionen, {:.1f}s)".format(entry['args'].file, future.result()[0].shape[0], time.time() - start))
+            else:
+                print("Export konnte nicht geladen werden: {}".format(entry['args'].file))
 
-    writeCSV(args.file, '_' + sxImportProSaldo  + heading, dfpp, csv.QUOTE_NONNUMERIC)
+    def status(self):
 
-    print("\n###### Kontenrahmen für Sammelbuchungen Dienstleistungen\n")
-    printAccountDict(dCAService, "Erlöse Dienstleistungen")
-    print("\n###### Kontenrahmen für Sammelbuchungen Waren\n")
-    printAccountDict(dCAGoods, "Erlöse Waren")
+        with self.lock:
+            return [{'file': key[0], 'compact': key[1], 'money': key[2],
+                'rows': int(entry['future'].result()[0].shape[0]) if entry['future'].done() and entry['future'].exception() is None else None,
+                'loading': not entry['future'].done()} for key, entry in self.entries.items()]
 
-    if (args.daily):
-        print ("\n###### Sammelbuchungen für jeden Tag erzeugen:\n")
-        timestamp = dfpp.index[-1] + dt.timedelta(days=1)
-        end_date  = timestamp.replace(hour=0, minute=0, second=0)
-        timestamp = dfpp.index[0]
-        start_date = timestamp.replace(hour=0, minute=0, second=0)
-        print(f"\tStartdate: {start_date}")
-        print(f"\tEnddate:   {end_date}\n")
-
-        for sdate in daterange(start_date, end_date):
-            edate = sdate + dt.timedelta(days=1)
-            strEndDate = edate.strftime('%Y-%m-%d')
-            strStartDate = sdate.strftime('%Y-%m-%d')
-            print(f"from {sdate} to {edate}:", end='')
-            dfi_daily = pd.DataFrame() #creates a new dataframe that's empty
-            dfc_daily = pd.DataFrame() #creates a new dataframe that's empty
-            dfpp_daily = selectReceiptDate(dfpp, strStartDate, strEndDate)
-            dfc_daily, dfi_daily = collectivePostings(args.text, ' ' + strStartDate, dfpp_daily, verbose = args.verbose)
-            if not dfc_daily.empty:
-                dfc = dfc.append(dfc_daily, ignore_index = True)
-                print(f"{dfc_daily.shape[0]} Sammelbuchungen ", end='\r')
+def lastByte(infile, size):
+
+    with open(infile, 'rb') as handle:
+        handle.seek(size - 1)
+        return handle.read(1)
+
+# Append the preprocessed new rows to the preprocessed dataframe, in the
+# order of preprocessDataframe (the new rows of an export come last and
+# are sorted again only if they are not in chronological order).
+
+def appendTransactions(dfp, new):
+
+    df = pd.concat([dfp, new])
+    for name in lCompactColumns + lCompactDerived:
+        if isinstance(dfp[name].dtype, pd.CategoricalDtype):
+            df[name] = compactColumn(df[name])
+    if df.index.hasnans or not df.index.is_monotonic_increasing:
+        df = sortTransactions(df)
+    return df
+
+dServer = {'parser': None, 'defaults': None, 'datasets': None, 'output': None, 'analysis': threading.Lock(), 'requests': 0}
+
+# Run one request, returns the HTTP status and the console output
+
+def runRequest(line):
+
+    parser = dServer['parser']
+    output = io.StringIO()
+    status = 200
+    with dServer['output'].capture(output):
+        try:
+            print("\n###### Auftrag: {}\n".format(line))
+            args = parser.parse_args(shlex.split(line), namespace=argparse.Namespace(**dServer['defaults']))
+            if (args.jobs is not None) or (args.serve is not None):
+                parser.error('die Optionen --jobs und --serve sind in einem Auftrag nicht erlaubt')
+            if args.memory or args.profile or (args.profile_json is not None) or (args.profile_dump is not None):
+                parser.error('die Optionen --memory und --profile sind im Server Modus nicht verfügbar')
+            if args.rules != dServer['defaults']['rules']:
+                parser.error('die Option --rules gilt für den ganzen Server')
+            if args.accounts:
+                printAccountPlan()
+            elif (args.files is None) and os.path.isfile(args.file) and (args.chunksize is None) and not args.incremental:
+                analyzeDataset(args)
             else:
-                print(f"0 Sammelbuchungen!", end='\r')
-            if not dfi_daily.empty:
-                dfi = dfi.append(dfi_daily, ignore_index = True)
-        print(f"\n\nTägliche Sammelbuchungen von {start_date} bis {end_date} wurden erzeugt\n")
-        if not dfc.empty:
-            dfsums = dfc.groupby(['Konto','Gegenkonto']).agg({'Betrag': "sum"}).reset_index()
-            print(dfsums)
-    else:
-        dfc, dfi = collectivePostings(args.text, heading, dfpp, verbose=True)
+                with dServer['analysis']:
+                    runJob(args)
+            print("\n###### Auftrag beendet\n")
+        except SystemExit:
+            status = 400
+            print("\n###### Auftrag fehlgeschlagen\n")
+        except Exception as e:
+            status = 500
+            print("\n###### Auftrag fehlgeschlagen: {}\n".format(e))
+    return status, output.getvalue()
+
+def analyzeDataset(args):
+
+    checkPeriods([args.period] if args.period is not None else [])
+    checkPeriods(args.periods if args.periods is not None else [])
+    dfp, receipts = dServer['datasets'].get(args)
+    with dServer['analysis']:
+        print("\nVorverarbeitete Daten aus dem Speicher übernommen: {}".format(args.file))
+        print("Gesamt Anz. Transaktionen\t {:>8d}".format(dfp.shape[0]))
+        checkReceipts(receipts, args.file if args.bon_report else None)
+        analyzeDataframe(args, dfp, receipts)
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+
+        line = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8').strip()
+        start = time.time()
+        status, output = runRequest(line)
+        dServer['requests'] += 1
+        print("Auftrag {}: {} -> {} ({:.2f}s)".format(dServer['requests'], line, status, time.time() - start))
+        self.reply(status, 'text/plain', output)
+
+    def do_GET(self):
+
+        if self.path.rstrip('/') != '/status':
+            self.reply(404, 'text/plain', "Unbekannter Pfad {}, Aufträge mit POST /\n".format(self.path))
+            return
+        self.reply(200, 'application/json', json.dumps({'version': programVersion, 'datasets': dServer['datasets'].status()}, indent=1) + '\n')
+
+    def reply(self, status, contentType, text):
+
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
 
-    writeCSV(args.file, '_' + sxCollectivePostings + heading, dfc, csv.QUOTE_NONNUMERIC)
-    if args.verbose:
-        writeCSV(args.file, '_' + sxTransactions + heading, dfi, csv.QUOTE_NONNUMERIC)
+def watchExports(datasets, directory):
 
-    if args.statistics:
-        dfstat, total = totalSalesByProduct(dfpp, topProducts)
-        printSalesByProduct(dfstat, total)
-        dfstat, total = totalSalesByProduct(dfpp, topCoupons)
-        printSalesByProduct(dfstat, total)
-        dfstat = dailySalesByProduct(dfpp, topProducts + topCoupons)
-        writeCSV(args.file, '_SalesByProduct' + heading, dfstat, csv.QUOTE_NONE)
+    while True:
+        try:
+            datasets.refresh(directory)
+        except Exception as e:
+            print("WARNUNG: Verzeichnis {} konnte nicht geprüft werden: {}".format(directory, e))
+        time.sleep(watchInterval)
 
-    print("\n###### Programm wurde normal beendet.\n")
+def serve(parser, args):
+
+    if args.memory or args.profile or (args.profile_json is not None) or (args.profile_dump is not None):
+        print("Die Optionen --memory und --profile können nicht mit --serve verwendet werden.")
+        exit(1)
+    if (args.watch is not None) and not os.path.isdir(args.watch):
+        print("Verzeichnis nicht gefunden: {}".format(args.watch))
+        exit(1)
+
+    defaults = dict(vars(args), serve=None, watch=None)
+    selectTaxRules(args.rules)
+    dServer['parser'], dServer['defaults'] = parser, defaults
+    dServer['datasets'] = DatasetCache(args.datasets, argparse.Namespace(**defaults))
+    dServer['output'] = ThreadOutput(sys.stdout)
+    sys.stdout = sys.stderr = dServer['output']
+
+    pd.DataFrame() # import pandas once, before the first request
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', args.serve), RequestHandler)
+    server.daemon_threads = True
+    if args.watch is not None:
+        threading.Thread(target=watchExports, args=(dServer['datasets'], args.watch), daemon=True).start()
+    print("\n###### Server bereit: http://127.0.0.1:{}/ (Ende mit Ctrl-C)\n".format(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        sys.stdout, sys.stderr = dServer['output'].stream, sys.__stderr__
+
+# Run the analysis selected by the options
+
+def analyze(args):
+
+    if args.files is not None:
+        if (args.chunksize is not None) or args.incremental:
+            print("Die Optionen --chunksize und --incremental können nicht mit --files verwendet werden.")
+            exit(1)
+        analyzeFiles(args)
+        return
+
+    if isColumnStore(args.file):
+        analyzeColumnStore(args)
+        return
+
+    if args.incremental:
+        if (args.period is not None) or (args.batch is not None) or (args.periods is not None) or (args.chunksize is not None):
+            print("Die Optionen --period, --batch, --periods und --chunksize können nicht mit --incremental verwendet werden.")
+            exit(1)
+        incrementalAnalysis(args)
+        return
+
+    if args.chunksize is not None:
+        periods, dfcp = streamDataframe(args)
+        if (args.batch is not None) or (args.periods is not None):
+            writeBatchPostings(args, [(start_date, end_date) for start_date, end_date, heading in periods], dfcp)
+        return
+
+    dfp, receipts = readEnrichedDataframe(args)
+    analyzeDataframe(args, dfp, receipts)
 
 
 # Driver code
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os, sys, argparse
+import io, json, time, platform, tempfile, shutil, subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+import datetime as dt
+import pandas as pd
+import numpy as np
+
+import analyzeGDPdU as gdpdu
+import makeGDPdU
+
+
+programVersion = '1.0.0'
+lastModified = '17-10-2026'
+
+#
+# PURPOSE: benchmark the processing steps of analyzeGDPdU.py
+#          with a GDPdU export or a synthetic export (makeGDPdU.py)
+#
+# DISCLAIMER:
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#
+# Each step is run --repeat times, the best wall time is reported. The peak
+# memory of a step is measured with tracemalloc in one extra run, so tracing
+# does not slow down the timed runs. The console output of analyzeGDPdU is
+# discarded.
+#
+# The results are written to a JSON file (option --output). With a baseline
+# (option --baseline, the JSON results of an earlier run) each step is
+# compared: a step is a regression if its time or peak memory is more than
+# --tolerance above the baseline (and more than minDeltaSeconds and
+# minDeltaMB, to ignore the noise of very short steps).
+# The exit code is 1 if there is a regression.
+#
+# With option --startup the startup time of analyzeGDPdU.py is measured:
+# the program is run without data (--help, an argument error, --accounts),
+# for comparison also the import of pandas and numpy alone.
+#
+
+minDeltaSeconds = 0.02
+minDeltaMB = 1.0
+postingText = 'Sammelbuchung'
+
+# The steps, in pipeline order. Each step gets the results of the earlier
+# steps in the dict 'data' and stores its own result there.
+
+def stepReadCSV(data):
+    data['da'] = gdpdu.readCSV(data['file'], data['compact'], data['engine'])
+
+def stepPreprocessDataframe(data):
+    data['dfp'] = gdpdu.preprocessDataframe(data['da'], checkBons=False, money=data['money'])
+
+def stepReceiptTable(data):
+    data['receipts'] = gdpdu.receiptTable(data['dfp'])
+
+def stepCheckBonNummer(data):
+    gdpdu.checkReceipts(data['receipts'])
+
+def stepSelectReceiptDate(data):
+    start_date, end_date = data['period']
+    data['dfpp'] = gdpdu.selectReceiptDate(data['dfp'], start_date, end_date)
+
+def stepCollectivePostings(data):
+    gdpdu.collectivePostings(postingText, '_All', data['dfp'], verbose=True)
+
+def stepDailyCollectivePostings(data):
+    gdpdu.dailyCollectivePostings(postingText, data['dfp'], verbose=True)
+
+def stepSalesByProductCube(data):
+    data['cube'] = gdpdu.salesByProductCube(data['dfp'])
+
+def stepTotalSalesByProduct(data):
+    gdpdu.totalSalesByProduct(data['dfp'], gdpdu.topProducts, data['cube'])
+    gdpdu.totalSalesByProduct(data['dfp'], gdpdu.topCoupons, data['cube'])
+
+def stepDailySalesByProduct(data):
+    gdpdu.dailySalesByProduct(data['dfp'], gdpdu.topProducts + gdpdu.topCoupons, data['cube'])
+
+lSteps = [
+    ('readCSV', stepReadCSV),
+    ('preprocessDataframe', stepPreprocessDataframe),
+    ('receiptTable', stepReceiptTable),
+    ('checkBonNummer', stepCheckBonNummer),
+    ('selectReceiptDate', stepSelectReceiptDate),
+    ('collectivePostings', stepCollectivePostings),
+    ('dailyCollectivePostings', stepDailyCollectivePostings),
+    ('salesByProductCube', stepSalesByProductCube),
+    ('totalSalesByProduct', stepTotalSalesByProduct),
+    ('dailySalesByProduct', stepDailySalesByProduct)
+]
+
+# The period for selectReceiptDate: the month of the transaction in the
+# middle of the export.
+
+def middleMonth(dfp):
+
+    dates = dfp.index.dropna()
+    middle = dates[len(dates) // 2]
+    start = middle.replace(day=1)
+    end = (start + dt.timedelta(days=32)).replace(day=1)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+
+# Run one step: best wall time of 'repeat' runs, then one run with tracemalloc.
+
+def runStep(step, data, repeat):
+
+    seconds = None
+    for n in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            step(data)
+            elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    tracemalloc.start()
+    try:
+        with redirect_stdout(io.StringIO()):
+            step(data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': round(seconds, 4), 'peakMB': round(peak / (1024 * 1024), 1)}
+
+def runBenchmark(infile, repeat, compact, engine, money='float'):
+
+    data = {'file': infile, 'compact': compact, 'engine': engine, 'money': money}
+    steps = {}
+    for name, step in lSteps:
+        if name == 'selectReceiptDate':
+            data['period'] = middleMonth(data['dfp'])
+        steps[name] = runStep(step, data, repeat)
+        print("{:<28} {:>10.3f} s {:>10.1f} MB".format(name, steps[name]['seconds'], steps[name]['peakMB']))
+
+    return {
+        'file': os.path.basename(infile),
+        'rows': int(data['dfp'].shape[0]),
+        'compact': compact,
+        'engine': engine,
+        'money': money,
+        'period': list(data['period']),
+        'steps': steps
+    }
+
+# Startup cases (option --startup): command line of a subprocess
+
+lStartupCases = [
+    ('help', ['analyzeGDPdU.py', '--help']),
+    ('argumentError', ['analyzeGDPdU.py']),
+    ('accounts', ['analyzeGDPdU.py', '--accounts']),
+    ('importPandas', ['-c', 'import pandas, numpy'])
+]
+
+def runStartup(repeat):
+
+    script = os.path.abspath(gdpdu.__file__)
+    startup = {}
+    for name, command in lStartupCases:
+        command = [script if part == 'analyzeGDPdU.py' else part for part in command]
+        seconds = None
+        for n in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+        startup[name] = {'seconds': round(seconds, 4)}
+        print("{:<28} {:>10.3f} s".format(name, seconds))
+
+    return startup
+
+# Compare with a baseline, returns the names of the steps with a regression.
+
+def compareBaseline(results, baseline, tolerance):
+
+    print("\n###### Vergleich mit der Basis {} (Version {})\n".format(baseline.get('file'), baseline.get('version')))
+    if 'steps' in results:
+        if baseline.get('rows') != results['rows']:
+            print("WARNUNG: Anzahl Transaktionen ist verschieden: {} (Basis {})\n".format(results['rows'], baseline.get('rows')))
+        for option in ['compact', 'engine', 'money']:
+            if baseline.get(option, 'float' if option == 'money' else None) != results[option]:
+                print("WARNUNG: Option {} ist verschieden: {} (Basis {})\n".format(option, results[option], baseline.get(option)))
+
+    regressions = []
+    print("{:<28} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8}".format('Schritt', 'Zeit s', 'Basis s', 'Faktor', 'MB', 'Basis MB', 'Faktor'))
+    for section in ['startup', 'steps']:
+        for name, new in results.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if old is None:
+                continue
+            slower = (new['seconds'] > old['seconds'] * (1 + tolerance)) and (new['seconds'] - old['seconds'] > minDeltaSeconds)
+            larger = ('peakMB' in new) and (new['peakMB'] > old['peakMB'] * (1 + tolerance)) and (new['peakMB'] - old['peakMB'] > minDeltaMB)
+            memory = "{:>10.1f} {:>10.1f} {:>8.2f}".format(new['peakMB'], old['peakMB'],
+                new['peakMB'] / old['peakMB'] if old['peakMB'] else float('nan')) if 'peakMB' in new else "{:>10} {:>10} {:>8}".format('', '', '')
+            print("{:<28} {:>10.3f} {:>10.3f} {:>8.2f} {} {}".format(name, new['seconds'], old['seconds'],
+                new['seconds'] / old['seconds'] if old['seconds'] else float('nan'), memory, 'REGRESSION' if slower or larger else ''))
+            if slower or larger:
+                regressions.append(name)
+
+    return regressions
+
+# Main function using argparse for commandline arguments and options
+
+def main():
+    print("\n###### This is {} Version {} last modified {} ######".format(os.path.basename(sys.argv[0]), programVersion, lastModified))
+    print("\nPython version is {}".format(sys.version))
+
+    parser = argparse.ArgumentParser(description='Laufzeit und Speicherbedarf der Verarbeitungsschritte von analyzeGDPdU.py messen')
+    source = parser.add_mutually_exclusive_group(required=False)
+    source.add_argument('-f', '--file', help='Name der CSV Datei mit dem KI-Kasse GDPdU export')
+    source.add_argument('-n', '--rows', type=makeGDPdU.parseRows,
+        help='Synthetischen Export mit ROWS Zeilen erzeugen (makeGDPdU.py), z.B. 60k, 1M oder 10M')
+    parser.add_argument('--date-format', help='Datumsformat des synthetischen Exports (Default: short)',
+        choices=list(makeGDPdU.dDateFormats), default='short')
+    parser.add_argument('-r', '--repeat', help='Anzahl Wiederholungen je Schritt (Default: 3)', type=int, default=3)
+    parser.add_argument('-o', '--output', help='Ergebnisse in die JSON Datei OUTPUT schreiben', required=False)
+    parser.add_argument('-B', '--baseline', help='Ergebnisse mit der JSON Datei BASELINE vergleichen', required=False)
+    parser.add_argument('--tolerance', help='Erlaubte Abweichung von der Basis (Default: 0.2 = 20%%)', type=float, default=0.2)
+    parser.add_argument('--engine', help='Verfahren zum Einlesen der CSV Datei (Default: classic)',
+        choices=['classic', 'single'], default='classic')
+    parser.add_argument('--compact', help='Textspalten als Kategorien speichern', action='store_true', default=False)
+    parser.add_argument('--money', help='Beträge als float (Default) oder in Cent (int64) rechnen',
+        choices=['float', 'cents'], default='float')
+    parser.add_argument('--startup', help='Startzeit von analyzeGDPdU.py ohne Daten messen (--help, Fehler, --accounts)',
+        action='store_true', default=False)
+    args = parser.parse_args()
+    if (args.file is None) and (args.rows is None) and not args.startup:
+        parser.error('eine der Optionen -f/--file, -n/--rows oder --startup ist erforderlich')
+
+    results = {
+        'program': 'analyzeGDPdU.py',
+        'version': gdpdu.programVersion,
+        'created': dt.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'repeat': args.repeat
+    }
+
+    if args.startup:
+        print("\n###### Startzeit ohne Daten\n")
+        results['startup'] = runStartup(args.repeat)
+
+    tmpdir = None
+    infile = args.file
+    if args.rows is not None:
+        tmpdir = tempfile.mkdtemp(prefix='benchmarkGDPdU')
+        infile = os.path.join(tmpdir, 'GDPdU_{}.csv'.format(args.rows))
+        print("\n###### Synthetischen Export mit {} Zeilen erzeugen\n".format(args.rows))
+        makeGDPdU.writeExport(infile, args.rows, dateFormat=args.date_format)
+
+    if infile is not None:
+        try:
+            print("\n###### Messung mit {}\n".format(infile))
+            results.update(runBenchmark(infile, args.repeat, args.compact, args.engine, args.money))
+        finally:
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print("\nErgebnisse gespeichert: {}".format(args.output))
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compareBaseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nWARNUNG: Regression in den Schritten {}".format(regressions))
+
+    print("\n###### Programm wurde normal beendet.\n")
+    exit(1 if regressions else 0)
+
+# Driver code
+
+if __name__ == '__main__':
+    main()
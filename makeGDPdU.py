@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os, sys, argparse
+import random
+import datetime as dt
+
+
+programVersion = '1.0.0'
+lastModified = '17-10-2026'
+
+#
+# PURPOSE: generate synthetic KI-Kasse GDPdU exports
+#          for tests and benchmarks of analyzeGDPdU.py (see benchmarkGDPdU.py)
+#
+# DISCLAIMER:
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+#
+# The export has the columns of KI-Kasse, one line per item of a Bon:
+# Kasse;Bon_Nummer;Datum;Uhrzeit;Umsatz Br.;Anzahl;Produkt;Einzel VK Br.;MwSt-Satz;MwSt;Dst/Ware;
+# Amounts use the German number format (thousands separator '.', decimal ',').
+#
+
+exportHeader = 'Kasse;Bon_Nummer;Datum;Uhrzeit;Umsatz Br.;Anzahl;Produkt;Einzel VK Br.;MwSt-Satz;MwSt;Dst/Ware;'
+
+# Date formats of the export (option --date-format)
+
+dDateFormats = {
+    'short': '%d-%m-%y',    # format used in the latest version of KI-Kasse
+    'long': '%d.%m.%Y'      # format used in Friseursoftware V4.8 by Kühnemann Informatik, 2017
+}
+
+# Products: name, price, tax rate, 'Dienst' or 'Ware', relative frequency.
+# The tax rate is written in both spellings of KI-Kasse ('19' and '19,00').
+
+lProducts = [
+    ('Erwachsene', 18.5, 19, 'Dienst', 30),
+    ('Feierabend/2 Std.', 14.0, 19, 'Dienst', 12),
+    ('Studenten', 12.5, 19, 'Dienst', 8),
+    ('10er Erw.', 165.0, 19, 'Dienst', 2),
+    ('20er Erw.', 310.0, 19, 'Dienst', 1),
+    ('10er Spezial', 120.0, 7, 'Ware', 1),
+    ('20er Spezial', 220.0, 7, 'Ware', 1),
+    ('50er Spezial', 1000.0, 0, 'Dienst', 1),
+    ('Massage', 45.0, 0, 'Dienst', 3),
+    ('Milchkaffee', 2.6, 19, 'Ware', 10),
+    ('Kaffee', 2.0, 19, 'Ware', 12),
+    ('Weizen alkf. (A)', 3.9, 19, 'Ware', 8),
+    ('Brezel', 1.8, 7, 'Ware', 8),
+    ('Kuchen', 3.5, 7, 'Ware', 6),
+    ('Gutschein', 25.0, 0, 'Ware', 1),
+    ('Handtuch', 4.0, 19, 'Ware', 4),
+    ('Bademantel', 6.0, 19, 'Ware', 3)
+]
+
+# Opening hours and share of special Bons
+
+openingHour = 9
+closingHour = 22
+returnRate = 0.01       # Bon is cancelled, all items with negative 'Anzahl'
+returnItemRate = 0.01   # single item is returned
+gapRate = 0.002         # Bon numbers are skipped
+
+# Number of rows with suffix k (1000) or M (1000000), e.g. 60k, 1M, 10M
+
+def parseRows(text):
+
+    factor = {'k': 1000, 'M': 1000000}.get(text[-1:], 1)
+    try:
+        rows = int(float(text.rstrip('kM')) * factor)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Ungültige Anzahl Zeilen: {}".format(text))
+    if rows <= 0:
+        raise argparse.ArgumentTypeError("Ungültige Anzahl Zeilen: {}".format(text))
+    return rows
+
+# German number format as written by KI-Kasse: no trailing zeros,
+# thousands separator '.', decimal ','
+
+def formatAmount(value):
+
+    text = ('%.2f' % abs(value)).rstrip('0').rstrip('.')
+    integer, _, fraction = text.partition('.')
+    groups = []
+    while len(integer) > 3:
+        groups.insert(0, integer[-3:])
+        integer = integer[:-3]
+    groups.insert(0, integer)
+    text = '.'.join(groups) + (',' + fraction if fraction else '')
+    return ('-' + text) if value < 0 and text != '0' else text
+
+def formatTaxRate(rate, rnd):
+
+    return str(rate) if rnd.random() < 0.5 else '{},00'.format(rate)
+
+# ';' in 'Produkt' (option --corrupt), KI-Kasse does not quote the field
+# and the line has one field too many
+
+def corruptProduct(name, rnd):
+
+    position = rnd.randint(1, len(name) - 1)
+    return name[:position] + ';' + name[position:]
+
+# Generate the lines of the export, one Bon at a time.
+
+def exportLines(rows, seed=1, dateFormat='short', start=dt.datetime(2018, 1, 1), corrupt=0.0):
+
+    rnd = random.Random(seed)
+    format = dDateFormats[dateFormat]
+    products = [product[:4] for product in lProducts]
+    weights = [product[4] for product in lProducts]
+
+    timestamp = start.replace(hour=openingHour)
+    bon = 46337
+    count = 0
+    while count < rows:
+        timestamp += dt.timedelta(seconds=rnd.randint(20, 600))
+        if timestamp.hour >= closingHour:
+            timestamp = (timestamp + dt.timedelta(days=1)).replace(hour=openingHour, minute=0, second=rnd.randint(0, 59))
+        bon += 1
+        if rnd.random() < gapRate:
+            bon += rnd.randint(1, 3)
+
+        datum = timestamp.strftime(format)
+        uhrzeit = timestamp.strftime('%H:%M:%S')
+        sign = -1 if rnd.random() < returnRate else 1
+        items = min(rnd.choice([1, 1, 1, 2, 2, 3, 4, 6]), rows - count)
+        for name, price, rate, kind in rnd.choices(products, weights, k=items):
+            anzahl = sign * rnd.choice([1, 1, 1, 1, 2, 3])
+            if sign > 0 and rnd.random() < returnItemRate:
+                anzahl = -anzahl
+            umsatz = price * anzahl
+            mwst = round(umsatz * rate / (100 + rate), 2)
+            if corrupt and rnd.random() < corrupt:
+                name = corruptProduct(name, rnd)
+            yield 'K1;{};{};{};{};{};{};{};{};{};{};'.format(bon, datum, uhrzeit, formatAmount(umsatz), anzahl,
+                name, formatAmount(price), formatTaxRate(rate, rnd), formatAmount(mwst), kind)
+        count += items
+
+def writeExport(outfile, rows, seed=1, dateFormat='short', corrupt=0.0):
+
+    with open(outfile, 'w', encoding='latin-1', newline='') as f:
+        f.write(exportHeader + '\n')
+        lines = []
+        for line in exportLines(rows, seed, dateFormat, corrupt=corrupt):
+            lines.append(line)
+            if len(lines) == 100000:
+                f.write('\n'.join(lines) + '\n')
+                lines = []
+        if lines:
+            f.write('\n'.join(lines) + '\n')
+
+# Main function using argparse for commandline arguments and options
+
+def main():
+    print("\n###### This is {} Version {} last modified {} ######".format(os.path.basename(sys.argv[0]), programVersion, lastModified))
+
+    parser = argparse.ArgumentParser(description='Synthetischen GDPdU Export von KI-Kasse erzeugen')
+    parser.add_argument('-n', '--rows', help='Anzahl Zeilen, z.B. 60k, 1M oder 10M (Default: 60k)',
+        type=parseRows, default=parseRows('60k'))
+    parser.add_argument('-o', '--output', help='Name der CSV Datei (Default: GDPdU_<rows>.csv)', required=False)
+    parser.add_argument('--date-format', help='Datumsformat: short (DD-MM-YY, Default) oder long (DD.MM.YYYY)',
+        choices=list(dDateFormats), default='short')
+    parser.add_argument('--seed', help='Startwert des Zufallsgenerators (Default: 1)', type=int, default=1)
+    parser.add_argument('--corrupt', help="Anteil der Zeilen mit ';' im Produktnamen (Default: 0)",
+        type=float, default=0.0)
+    args = parser.parse_args()
+
+    outfile = args.output if args.output is not None else 'GDPdU_{}.csv'.format(args.rows)
+    writeExport(outfile, args.rows, args.seed, args.date_format, args.corrupt)
+    print("\nGDPdU Export mit {} Zeilen geschrieben: {}".format(args.rows, outfile))
+
+# Driver code
+
+if __name__ == '__main__':
+    main()
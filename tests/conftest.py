@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+import os, sys
+
+# analyzeGDPdU.py is a script in the root of the repository, not a package
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Amounts in integer cents (option --money cents). Both engines round an
+# amount with more than two decimals half away from zero and warn, values
+# that are not numbers in the German format stop the run.
+#
+
+import os, sys, subprocess
+
+import numpy as np
+import pytest
+
+import analyzeGDPdU
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+scriptFile = os.path.join(os.path.dirname(testDir), 'analyzeGDPdU.py')
+goldenExport = os.path.join(testDir, 'data', 'GDPdU_golden.csv')
+
+lOutputs = ['Import_All', 'Sammelbuchungen_All', 'Transaktionen_All', 'SalesByProduct_All']
+
+def test_parse_cents():
+
+    values = ['12,345', '-12,345', '0,005', '-0,0049', '12,340', '1.234,56', '12.345.678,9', '-1.234', '1234']
+    cents, valid, rounded = analyzeGDPdU.parseCents(np.array(values, dtype=object))
+    assert list(cents) == [1235, -1235, 1, 0, 1234, 123456, 1234567890, -123400, 123400]
+    assert valid.all()
+    assert list(rounded) == [True, True, True, True, False, False, False, False, False]
+
+@pytest.mark.parametrize('value', ['1..2', '.5', '-.5', '1.2', '1.23', '1,2.3', '1,2,3', '12-', '-', 'abc', 'ä'])
+def test_parse_cents_rejects(value):
+
+    cents, valid, rounded = analyzeGDPdU.parseCents(np.array([value], dtype=object))
+    assert not valid[0] and not rounded[0] and cents[0] == 0
+
+# 'Milchkaffee' in Bon 1001 costs 2,605 instead of 2,6 (2.605 is 2.60499... as a float)
+
+def runAnalysis(directory, amount, options):
+
+    os.makedirs(directory)
+    infile = os.path.join(directory, 'GDPdU.csv')
+    with open(goldenExport, 'rb') as f:
+        data = f.read().replace(b';2,6;1;Milchkaffee;2,6;', ';{0};1;Milchkaffee;{0};'.format(amount).encode('latin-1'))
+    with open(infile, 'wb') as f:
+        f.write(data)
+    result = subprocess.run([sys.executable, scriptFile, '-f', infile, '-v', '-s', '--money', 'cents'] + options,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=directory)
+    return os.path.join(directory, 'GDPdU'), result
+
+@pytest.mark.parametrize('engine', ['classic', 'single'])
+def test_rounded_amount(tmp_path, engine):
+
+    stem, result = runAnalysis(os.path.join(str(tmp_path), 'inexact'), '2,605', ['--engine', engine])
+    output = result.stdout.decode('latin-1')
+    assert result.returncode == 0, output
+    assert 'Nachkommastellen in Spalte Umsatz Br.' in output
+    expected, _ = runAnalysis(os.path.join(str(tmp_path), 'exact'), '2,61', ['--engine', engine])
+    for name in lOutputs:
+        with open(stem + '_' + name + '.csv', 'rb') as f, open(expected + '_' + name + '.csv', 'rb') as g:
+            assert f.read() == g.read(), name
+
+def test_misplaced_dot(tmp_path):
+
+    _, result = runAnalysis(os.path.join(str(tmp_path), 'dot'), '2..6', [])
+    output = result.stdout.decode('latin-1')
+    assert result.returncode != 0
+    assert "keine Zahlen im Format -1.234,56: ['2..6']" in output
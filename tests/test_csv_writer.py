@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Golden file tests of the output files (ProSaldo / MonkeyOffice imports).
+# The fast CSV writer (see csvChunks) must write the same bytes as
+# DataFrame.to_csv. The expected files in data/expected were written with
+# to_csv for every file, from the export data/GDPdU_golden.csv. The export
+# covers missing values (empty MwSt), -0.0 amounts, texts that need quoting,
+# Latin-1 characters and Bons with several lines.
+#
+
+import os, sys, csv, shutil, subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analyzeGDPdU
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+scriptFile = os.path.join(os.path.dirname(testDir), 'analyzeGDPdU.py')
+goldenExport = os.path.join(testDir, 'data', 'GDPdU_golden.csv')
+expectedDir = os.path.join(testDir, 'data', 'expected')
+
+lGoldenFiles = ['Import_All', 'Sammelbuchungen_All', 'Transaktionen_All', 'SalesByProduct_All']
+
+def runAnalysis(tmp_path, options):
+
+    infile = os.path.join(str(tmp_path), os.path.basename(goldenExport))
+    shutil.copy(goldenExport, infile)
+    result = subprocess.run([sys.executable, scriptFile, '-f', infile, '-v', '-s'] + options,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=str(tmp_path))
+    assert result.returncode == 0, result.stdout.decode('latin-1')
+    return os.path.splitext(infile)[0]
+
+def readBytes(path):
+
+    with open(path, 'rb') as f:
+        return f.read()
+
+# --compact stores the text columns as categoricals, the files are the same
+
+@pytest.mark.parametrize('options', [[], ['--compact']], ids=['default', 'compact'])
+def test_golden_files(tmp_path, options):
+
+    stem = runAnalysis(tmp_path, options)
+    for name in lGoldenFiles:
+        expected = readBytes(os.path.join(expectedDir, 'GDPdU_golden_' + name + '.csv'))
+        assert readBytes(stem + '_' + name + '.csv') == expected, name
+
+# The writer against to_csv on a dataframe with the cases of the output
+# files, written in chunks of 3 rows: a multi-line text falls back to
+# to_csv for its chunk.
+
+def edgeCaseFrame():
+
+    return pd.DataFrame({
+        'Bon_Nummer': np.arange(1, 11, dtype=np.int64),
+        'Betrag': [1.5, -0.0, 0.0, np.nan, -2.25, 1e6, 0.005, -0.0, 3.0, np.nan],
+        'Produkt': ['Kaffee', 'Weizen "alkf." (A)', 'a;b', '', None, 'Säfte', 'zwei\nZeilen', 'Kaffee', ' x ', 'Brezel'],
+        'Konto': pd.Categorical(['1600', '4404', None, '4404', '4000', '1600', '4404', None, '4305', '1600']),
+        'DateTime': pd.to_datetime(['2018-03-01 09:05:10', None, '2018-03-01 10:00:00', '2018-03-02 00:00:00',
+            '2018-03-02 11:30:00', '2018-03-02 11:30:00', None, '2018-03-03 09:00:00', '2018-03-03 10:30:00', '2018-03-03 18:05:00']),
+        'Anzahl': [1, -1, 0, 2, 1, 1, 3, -2, 1, 1]
+    })
+
+@pytest.mark.parametrize('quot', [csv.QUOTE_NONNUMERIC, csv.QUOTE_MINIMAL], ids=['nonnumeric', 'minimal'])
+def test_writer_matches_to_csv(tmp_path, monkeypatch, quot):
+
+    monkeypatch.setattr(analyzeGDPdU, 'csvChunkRows', 3)
+    df = edgeCaseFrame()
+    outfile = os.path.join(str(tmp_path), 'writer.csv')
+    expectedFile = os.path.join(str(tmp_path), 'to_csv.csv')
+    analyzeGDPdU.writeFrame(outfile, df, quot)
+    df.to_csv(path_or_buf=expectedFile, encoding='latin-1', quoting=quot, **analyzeGDPdU.dCSVFormat)
+    assert readBytes(outfile) == readBytes(expectedFile)
+
+def test_writer_matches_to_csv_without_quoting(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(analyzeGDPdU, 'csvChunkRows', 3)
+    df = edgeCaseFrame().drop(columns=['Produkt'])
+    outfile = os.path.join(str(tmp_path), 'writer.csv')
+    expectedFile = os.path.join(str(tmp_path), 'to_csv.csv')
+    analyzeGDPdU.writeFrame(outfile, df, csv.QUOTE_NONE)
+    df.to_csv(path_or_buf=expectedFile, encoding='latin-1', quoting=csv.QUOTE_NONE, **analyzeGDPdU.dCSVFormat)
+    assert readBytes(outfile) == readBytes(expectedFile)
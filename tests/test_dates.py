@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# An unreadable 'Datum' gives a NaT DateTime (see buildDateTime). The row is
+# sorted last and the analysis goes on: the daily collective postings and
+# the daily sales statistics leave it out, in normal and in streaming mode.
+#
+
+import os, sys, subprocess
+
+import pytest
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+scriptFile = os.path.join(os.path.dirname(testDir), 'analyzeGDPdU.py')
+goldenExport = os.path.join(testDir, 'data', 'GDPdU_golden.csv')
+
+badLine = 4 # Bon 1003, a return of 'Erwachsene' on 01-03-18
+
+def writeExport(path, badDate):
+
+    with open(goldenExport, 'rb') as f:
+        lines = f.read().split(b'\r\n')
+    if badDate:
+        lines[badLine] = lines[badLine].replace(b';01-03-18;', b';xx-03-18;')
+    else:
+        del lines[badLine]
+    with open(path, 'wb') as f:
+        f.write(b'\r\n'.join(lines))
+
+def runAnalysis(directory, badDate, options):
+
+    os.makedirs(directory)
+    infile = os.path.join(directory, 'GDPdU.csv')
+    writeExport(infile, badDate)
+    result = subprocess.run([sys.executable, scriptFile, '-f', infile] + options,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=directory)
+    output = result.stdout.decode('latin-1')
+    assert result.returncode == 0, output
+    assert 'Traceback' not in output, output
+    return os.path.join(directory, 'GDPdU'), output
+
+@pytest.mark.parametrize('options', [['-d', '-s'], ['--chunksize', '5', '-d', '-s'], ['--chunksize', '5', '-d', '-b', 'monthly']],
+    ids=['normal', 'streaming', 'streaming-batch'])
+def test_bad_date(tmp_path, options):
+
+    stem, output = runAnalysis(os.path.join(str(tmp_path), 'bad'), True, options)
+    assert 'xx-03-18' in output
+    clean, _ = runAnalysis(os.path.join(str(tmp_path), 'clean'), False, options)
+
+    names = ['Sammelbuchungen_vom_2018-03-01_bis_2018-04-01'] if '-b' in options else ['Sammelbuchungen_All', 'SalesByProduct_All']
+    for name in names:
+        with open(stem + '_' + name + '.csv', 'rb') as f, open(clean + '_' + name + '.csv', 'rb') as g:
+            assert f.read() == g.read(), name
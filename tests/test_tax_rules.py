@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Tax keys and accounts from the rule file GDPdU_Regeln.csv (option --rules)
+# around the reduced rates of the COVID-19 period (01.07.2020 - 31.12.2020).
+# A rate outside the rules of its rate is flagged in 'ChangeLog' and keeps
+# the tax key of its own rate.
+#
+
+import os, sys, csv, subprocess
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+scriptFile = os.path.join(os.path.dirname(testDir), 'analyzeGDPdU.py')
+rulesFile = os.path.join(os.path.dirname(testDir), 'GDPdU_Regeln.csv')
+
+header = 'Kasse;Bon_Nummer;Datum;Uhrzeit;Umsatz Br.;Anzahl;Produkt;Einzel VK Br.;MwSt-Satz;MwSt;Dst/Ware;'
+
+# Bon, Datum, MwSt-Satz, Dst/Ware and the expected St-SL, Gegenkonto and ChangeLog
+
+lCases = [
+    (1, '30-06-20', '19,00', 'Dienst', 'USt19', '4404', ''),
+    (2, '30-06-20', '7,00', 'Ware', 'USt7', '4305', ''),
+    (3, '01-07-20', '16,00', 'Dienst', 'USt16', '4404', ''),
+    (4, '15-08-20', '5,00', 'Ware', 'USt5', '4305', ''),
+    (5, '01-07-20', '19,00', 'Dienst', 'USt19', '4404', 'tax rate 19 not valid on this date'),
+    (6, '31-12-20', '7,00', 'Ware', 'USt7', '4305', 'tax rate 7 not valid on this date'),
+    (7, '01-01-21', '19,00', 'Ware', 'USt19', '4405', ''),
+    (8, '01-01-21', '16,00', 'Dienst', 'USt16', '4404', 'tax rate 16 not valid on this date'),
+    (9, '30-06-20', '5,00', 'Ware', 'USt5', '4305', 'tax rate 5 not valid on this date'),
+    (10, '02-01-21', '0', 'Ware', '-', '4000', ''),
+]
+
+def test_covid_rates(tmp_path):
+
+    infile = os.path.join(str(tmp_path), 'GDPdU.csv')
+    with open(infile, 'w', encoding='latin-1', newline='') as f:
+        f.write(header + '\r\n')
+        for bon, date, rate, kind, _, _, _ in lCases:
+            f.write('K1;{};{};10:00:00;10;1;Artikel;10;{};1;{};\r\n'.format(bon, date, rate, kind))
+    result = subprocess.run([sys.executable, scriptFile, '-f', infile, '--rules', rulesFile, '-v'],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=str(tmp_path))
+    output = result.stdout.decode('latin-1')
+    assert result.returncode == 0, output
+    assert 'MwSt-Satz 19 in 1 Buchungen' in output
+
+    with open(os.path.join(str(tmp_path), 'GDPdU_Transaktionen_All.csv'), encoding='latin-1', newline='') as f:
+        rows = {int(row['Bon_Nummer']): row for row in csv.DictReader(f, delimiter=';')}
+    for bon, date, rate, _, taxKey, account, changeLog in lCases:
+        row = rows[bon]
+        assert (row['St-SL'], row['Gegenkonto'], row['ChangeLog']) == (taxKey, account, changeLog), (bon, date, rate)